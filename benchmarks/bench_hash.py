@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import tempfile
+import time
+
+from rik.integrity.hashers import new_hasher
+from rik.integrity.reader  import FileReader
+from rik.path_constraints import parse_size
+
+LEGACY_CHUNK_SIZE = 4096
+
+def parse_cmdargs():
+    parser = argparse.ArgumentParser(
+        description = "Measure hashing throughput of rik file readers"
+    )
+
+    parser.add_argument(
+        '-s', '--size',
+        default = '512M',
+        dest    = 'size',
+        help    = 'Size of the test file',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '-H', '--hash',
+        default = 'sha256',
+        dest    = 'hash_name',
+        help    = 'Hash to calculate',
+    )
+
+    parser.add_argument(
+        '-n', '--repeat',
+        default = 3,
+        dest    = 'repeat',
+        help    = 'Number of repetitions (best one is reported)',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '-c', '--chunk-size',
+        action  = 'append',
+        default = [],
+        dest    = 'chunk_sizes',
+        help    = 'Chunk sizes to test',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        'path',
+        default = None,
+        help    = 'Existing file to hash (a temporary one is made otherwise)',
+        metavar = 'FILE',
+        nargs   = '?',
+    )
+
+    return parser.parse_args()
+
+def hash_legacy(path, hash_name):
+    m = new_hasher(hash_name)
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda f=f : f.read(LEGACY_CHUNK_SIZE), b''):
+            m.update(chunk)
+
+    return m.hexdigest()
+
+def hash_reader(path, hash_name, reader):
+    m = new_hasher(hash_name)
+    reader.digest(path, [ m ])
+
+    return m.hexdigest()
+
+def measure(func, size, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+
+        if (best is None) or (elapsed < best):
+            best = elapsed
+
+    return size / best / (1024 * 1024)
+
+def make_test_file(size):
+    # pylint: disable=consider-using-with
+    f = tempfile.NamedTemporaryFile(prefix = 'rik_bench_', delete = False)
+
+    with f:
+        block = os.urandom(1024 * 1024)
+        for offset in range(0, size, len(block)):
+            f.write(block[:size - offset])
+
+    return f.name
+
+def main():
+    cmdargs     = parse_cmdargs()
+    chunk_sizes = cmdargs.chunk_sizes or [ 64 * 1024, 1024 * 1024 ]
+    path        = cmdargs.path
+    temporary   = (path is None)
+
+    if temporary:
+        path = make_test_file(cmdargs.size)
+
+    size = os.path.getsize(path)
+
+    benchmarks = [
+        ('legacy read(4k)', lambda : hash_legacy(path, cmdargs.hash_name)),
+        (
+            'file_digest',
+            lambda : hash_reader(path, cmdargs.hash_name, FileReader())
+        ),
+    ]
+
+    for chunk_size in chunk_sizes:
+        for use_mmap in [ False, True ]:
+            reader = FileReader(chunk_size, use_mmap)
+            name   = f"{'mmap' if use_mmap else 'readinto'}({chunk_size})"
+
+            benchmarks.append((
+                name,
+                lambda reader=reader : hash_reader(
+                    path, cmdargs.hash_name, reader
+                )
+            ))
+
+    try:
+        print(f"Hash: {cmdargs.hash_name}. File size: {size} bytes")
+
+        for (name, func) in benchmarks:
+            speed = measure(func, size, cmdargs.repeat)
+            print(f"{name:>24} : {speed:10.1f} MB/s")
+    finally:
+        if temporary:
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from bench_rik import measure, remove_storages, STUB_PAR2_DIR
+
+from rik.consts import RESULT_OK
+from rik.funcs  import select_integrity, walk_filesystem, build_constraints
+from rik.integrity.par2          import PAR2_DEFAULT_ARGS, PAR2_STORAGE_NAME
+from rik.integrity.par2_profiles import load_par2_profiles
+from rik.path_constraints        import parse_size
+from rik.sinks                   import ResultSink
+
+DEFAULT_TIERS = [ '16k', '512k', '16M', '256M' ]
+
+# Files of a tier are written from a shared random pool
+DATA_POOL_SIZE = 4 * 1024 * 1024
+
+VARIANT_FIXED   = 'fixed'
+VARIANT_PROFILE = 'profile'
+
+def parse_cmdargs():
+    parser = argparse.ArgumentParser(
+        description = (
+            "Measure par2 create and verify times per file size tier,"
+            " with size-tiered profiles against the fixed default arguments"
+        )
+    )
+
+    parser.add_argument(
+        '-t', '--tier',
+        action  = 'append',
+        default = [],
+        dest    = 'tiers',
+        help    = (
+            'File size of a tier (default: '
+            + ', '.join(DEFAULT_TIERS) + ')'
+        ),
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--files',
+        default = 4,
+        dest    = 'n_files',
+        help    = 'Number of files of each tier',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--profiles',
+        default = 'builtin',
+        dest    = 'profiles',
+        help    = "Par2 profiles to compare: 'builtin' or a table file",
+        metavar = 'SPEC',
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        default = 1,
+        dest    = 'jobs',
+        help    = 'Number of parallel jobs',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '-n', '--repeat',
+        default = 3,
+        dest    = 'repeat',
+        help    = 'Number of repetitions (best one is reported)',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--stub-par2',
+        action  = 'store_true',
+        default = False,
+        dest    = 'stub_par2',
+        help    = 'Use the par2 stub instead of par2 from PATH (smoke test)',
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        default = None,
+        dest    = 'output',
+        help    = 'Write JSON results to a file instead of stdout',
+        metavar = 'PATH',
+    )
+
+    return parser.parse_args()
+
+def generate_tier(root, size, n_files):
+    pool = os.urandom(min(size, DATA_POOL_SIZE))
+
+    os.makedirs(root)
+
+    for idx in range(n_files):
+        with open(os.path.join(root, f"file_{idx}"), 'wb') as f:
+            remaining = size
+
+            # NOTE: the offset differs per file, so that they do not match
+            while remaining > 0:
+                start = (idx * 4099 + remaining) % len(pool)
+                chunk = pool[start:start + remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+
+def get_recovery_bytes(root):
+    result = 0
+
+    for (dirpath, _dirnames, filenames) in os.walk(root):
+        if os.path.basename(dirpath) != PAR2_STORAGE_NAME:
+            continue
+
+        for name in filenames:
+            result += os.path.getsize(os.path.join(dirpath, name))
+
+    return result
+
+def run_par2(root, cmdargs, profiles, create):
+    dir_constraints, file_constraints = build_constraints()
+
+    integrity = select_integrity(
+        'par2', create, False, -1, jobs = cmdargs.jobs,
+        par2_profiles = profiles
+    )
+
+    sink = walk_filesystem(
+        root, integrity, dir_constraints, file_constraints,
+        create, False, (not create), cmdargs.jobs, ResultSink()
+    )
+
+    return {
+        'files'  : sink.n_total,
+        'errors' : sink.n_total - sink.counts[RESULT_OK],
+    }
+
+def bench_tier(root, cmdargs, profiles):
+    result = {}
+    clean  = lambda : remove_storages(root)
+
+    for (name, variant) in [
+        (VARIANT_FIXED, None), (VARIANT_PROFILE, profiles)
+    ]:
+        create = measure(
+            lambda v=variant : run_par2(root, cmdargs, v, True),
+            cmdargs.repeat, clean
+        )
+        verify = measure(
+            lambda v=variant : run_par2(root, cmdargs, v, False),
+            cmdargs.repeat
+        )
+
+        result[name] = {
+            'create_seconds' : create['seconds'],
+            'verify_seconds' : verify['seconds'],
+            'recovery_bytes' : get_recovery_bytes(root),
+            'errors'         : create['errors'] + verify['errors'],
+        }
+
+        remove_storages(root)
+
+    return result
+
+def print_results(results):
+    for (tier, result) in results.items():
+        fixed   = result[VARIANT_FIXED]
+        profile = result[VARIANT_PROFILE]
+
+        print(
+            f"{tier:>12} :"
+            f" create {fixed['create_seconds']:8.3f} s"
+            f" -> {profile['create_seconds']:8.3f} s,"
+            f" verify {fixed['verify_seconds']:8.3f} s"
+            f" -> {profile['verify_seconds']:8.3f} s,"
+            f" recovery {fixed['recovery_bytes']:>12}"
+            f" -> {profile['recovery_bytes']:>12} B",
+            file = sys.stderr
+        )
+
+def main():
+    cmdargs  = parse_cmdargs()
+    tiers    = cmdargs.tiers or [ parse_size(x) for x in DEFAULT_TIERS ]
+    profiles = load_par2_profiles(cmdargs.profiles)
+    results  = {}
+
+    logging.basicConfig(level = logging.ERROR)
+
+    if cmdargs.stub_par2:
+        os.environ['PATH'] = STUB_PAR2_DIR + os.pathsep + os.environ['PATH']
+
+    tmpdir = tempfile.mkdtemp(prefix = 'rik_bench_par2_')
+
+    try:
+        for size in tiers:
+            root = os.path.join(tmpdir, str(size))
+            generate_tier(root, size, cmdargs.n_files)
+
+            results[str(size)] = {
+                'par2_args' : {
+                    VARIANT_FIXED   : PAR2_DEFAULT_ARGS,
+                    VARIANT_PROFILE : profiles.select(size),
+                },
+                **bench_tier(root, cmdargs, profiles)
+            }
+
+            shutil.rmtree(root)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print_results(results)
+
+    output = {
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'jobs'      : cmdargs.jobs,
+        'repeat'    : cmdargs.repeat,
+        'files'     : cmdargs.n_files,
+        'stub_par2' : cmdargs.stub_par2,
+        'profiles'  : cmdargs.profiles,
+        'results'   : results,
+    }
+
+    if cmdargs.output is None:
+        print(json.dumps(output, indent = 4))
+    else:
+        with open(cmdargs.output, 'wt', encoding = 'utf-8') as f:
+            json.dump(output, f, indent = 4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from gen_tree import add_tree_args, get_tree_config, generate_tree
+
+from rik.funcs import (
+    check_constraints, select_integrity, walk_directories, walk_filesystem,
+    DEFAULT_EXCLUDES
+)
+from rik.integrity.hash   import HASH_STORAGE_PREFIX
+from rik.integrity.par2   import PAR2_STORAGE_NAME
+from rik.integrity.reader import FileReader
+from rik.path_constraints import (
+    ConstraintSet, GlobConstraint, FileSizeConstraint
+)
+from rik.sinks            import ResultSink, RESULT_NAMES
+
+STUB_PAR2_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'bin'
+)
+
+PHASES = [
+    'walk', 'constraints', 'constraints-list', 'hash-create', 'hash-verify',
+    'par2-create', 'par2-verify',
+]
+
+# Extra excludes, so that constraint evaluation is not trivially short
+BENCH_EXCLUDES = [ '*.tmp', '*.bak', '.cache', 'node_modules', '*~' ]
+BENCH_SIZES    = [ '<1G' ]
+
+def parse_cmdargs():
+    parser = argparse.ArgumentParser(
+        description = "Measure throughput of rik on a synthetic tree"
+    )
+
+    add_tree_args(parser)
+
+    parser.add_argument(
+        '--tree',
+        default = None,
+        dest    = 'tree',
+        help    = 'Use an existing tree instead of generating one.'
+                  ' Integrity files are created in and removed from it',
+        metavar = 'DIR',
+    )
+
+    parser.add_argument(
+        '-p', '--phase',
+        action  = 'append',
+        choices = PHASES,
+        default = [],
+        dest    = 'phases',
+        help    = 'Phases to run (all by default)',
+    )
+
+    parser.add_argument(
+        '-H', '--hash',
+        default = 'sha256',
+        dest    = 'hash_name',
+        help    = 'Hash integrity to use',
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        default = 1,
+        dest    = 'jobs',
+        help    = 'Number of parallel jobs',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '-n', '--repeat',
+        default = 3,
+        dest    = 'repeat',
+        help    = 'Number of repetitions (best one is reported)',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--real-par2',
+        action  = 'store_true',
+        default = False,
+        dest    = 'real_par2',
+        help    = 'Use par2 from PATH instead of the stub',
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        default = None,
+        dest    = 'output',
+        help    = 'Write JSON results to a file instead of stdout',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--compare',
+        default = None,
+        dest    = 'compare',
+        help    = 'Compare results with an earlier JSON output',
+        metavar = 'PATH',
+    )
+
+    return parser.parse_args()
+
+def make_constraints(compiled = True):
+    dir_constraints  = [
+        GlobConstraint(x, True) for x in DEFAULT_EXCLUDES + BENCH_EXCLUDES
+    ]
+    file_constraints = dir_constraints + [
+        FileSizeConstraint.from_string(x) for x in BENCH_SIZES
+    ]
+
+    if compiled:
+        dir_constraints  = ConstraintSet(dir_constraints)
+        file_constraints = ConstraintSet(file_constraints)
+
+    return (dir_constraints, file_constraints)
+
+def remove_storages(root):
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        if PAR2_STORAGE_NAME in dirnames:
+            shutil.rmtree(os.path.join(dirpath, PAR2_STORAGE_NAME))
+            dirnames.remove(PAR2_STORAGE_NAME)
+
+        for name in filenames:
+            if name.startswith(HASH_STORAGE_PREFIX):
+                os.remove(os.path.join(dirpath, name))
+
+def collect_entries(root, dir_constraints):
+    result = []
+
+    for (_root_entry, files) in walk_directories(
+        root, dir_constraints, ResultSink()
+    ):
+        result += files
+
+    return result
+
+def run_walk(root, dir_constraints):
+    sink    = ResultSink()
+    n_files = 0
+
+    for (_root_entry, files) in walk_directories(root, dir_constraints, sink):
+        n_files += len(files)
+
+    return { 'files' : n_files }
+
+def run_constraints(entries, file_constraints):
+    n_passed = sum(
+        1 for x in entries if check_constraints(x, file_constraints)
+    )
+    return { 'files' : len(entries), 'passed' : n_passed }
+
+def run_integrity(root, name, cmdargs, create, verify):
+    dir_constraints, file_constraints = make_constraints()
+
+    integrity = select_integrity(
+        name, create, False, -1, jobs = cmdargs.jobs, reader = FileReader()
+    )
+
+    sink = walk_filesystem(
+        root, integrity, dir_constraints, file_constraints,
+        create, False, verify, cmdargs.jobs, ResultSink()
+    )
+
+    counts = {
+        RESULT_NAMES.get(k, str(k)) : v for (k, v) in sink.counts.items()
+    }
+
+    return { 'files' : sink.n_total, 'counts' : counts }
+
+def measure(func, repeat, setup = None):
+    best   = None
+    result = None
+
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start   = time.perf_counter()
+        result  = func()
+        elapsed = time.perf_counter() - start
+
+        if (best is None) or (elapsed < best):
+            best = elapsed
+
+    result['seconds'] = best
+
+    return result
+
+def make_phases(root, cmdargs, n_bytes):
+    dir_constraints, file_constraints = make_constraints()
+    _, file_constraint_list           = make_constraints(compiled = False)
+
+    entries = collect_entries(root, dir_constraints)
+    clean   = lambda : remove_storages(root)
+
+    # NOTE: (function, setup, number of bytes read)
+    return {
+        'walk' : (
+            lambda : run_walk(root, dir_constraints), None, 0
+        ),
+        'constraints' : (
+            lambda : run_constraints(entries, file_constraints), None, 0
+        ),
+        'constraints-list' : (
+            lambda : run_constraints(entries, file_constraint_list), None, 0
+        ),
+        'hash-create' : (
+            lambda : run_integrity(
+                root, cmdargs.hash_name, cmdargs, True, False
+            ),
+            clean, n_bytes
+        ),
+        'hash-verify' : (
+            lambda : run_integrity(
+                root, cmdargs.hash_name, cmdargs, False, True
+            ),
+            None, n_bytes
+        ),
+        'par2-create' : (
+            lambda : run_integrity(root, 'par2', cmdargs, True, False),
+            clean, n_bytes
+        ),
+        'par2-verify' : (
+            lambda : run_integrity(root, 'par2', cmdargs, False, True),
+            None, n_bytes
+        ),
+    }
+
+def get_tree_bytes(root):
+    result = 0
+
+    for (dirpath, _dirnames, filenames) in os.walk(root):
+        for name in filenames:
+            result += os.path.getsize(os.path.join(dirpath, name))
+
+    return result
+
+def print_results(results, baseline):
+    for (name, result) in results.items():
+        line = f"{name:>16} : {result['seconds']:8.3f} s"
+
+        if 'mb_per_s' in result:
+            line += f" {result['mb_per_s']:10.1f} MB/s"
+
+        if name in baseline:
+            speedup = baseline[name]['seconds'] / result['seconds']
+            line   += f"  x{speedup:.2f} vs baseline"
+
+        print(line, file = sys.stderr)
+
+def run_benchmarks(root, cmdargs):
+    phases = cmdargs.phases or PHASES
+
+    # NOTE: verification needs integrities created first
+    if ('hash-verify' in phases) and ('hash-create' not in phases):
+        phases = [ 'hash-create' ] + phases
+
+    if ('par2-verify' in phases) and ('par2-create' not in phases):
+        phases = [ 'par2-create' ] + phases
+
+    remove_storages(root)
+
+    n_bytes   = get_tree_bytes(root)
+    functions = make_phases(root, cmdargs, n_bytes)
+    results   = {}
+
+    for name in PHASES:
+        if name not in phases:
+            continue
+
+        func, setup, n_read = functions[name]
+        result = measure(func, cmdargs.repeat, setup)
+
+        if n_read > 0:
+            result['mb_per_s'] = n_read / result['seconds'] / (1024 * 1024)
+
+        result['files_per_s'] = result['files'] / result['seconds']
+        results[name] = result
+
+    remove_storages(root)
+
+    return (results, n_bytes)
+
+def main():
+    cmdargs   = parse_cmdargs()
+    temporary = (cmdargs.tree is None)
+    root      = cmdargs.tree
+    tree      = { 'path' : root }
+    baseline  = {}
+
+    logging.basicConfig(level = logging.ERROR)
+
+    if not cmdargs.real_par2:
+        os.environ['PATH'] = STUB_PAR2_DIR + os.pathsep + os.environ['PATH']
+
+    if cmdargs.compare is not None:
+        with open(cmdargs.compare, 'rt', encoding = 'utf-8') as f:
+            baseline = json.load(f)['results']
+
+    if temporary:
+        root = tempfile.mkdtemp(prefix = 'rik_bench_')
+        tree = get_tree_config(cmdargs)
+        tree.update(generate_tree(root, **tree))
+
+    try:
+        results, n_bytes = run_benchmarks(root, cmdargs)
+    finally:
+        if temporary:
+            shutil.rmtree(root)
+
+    tree['bytes'] = n_bytes
+    print_results(results, baseline)
+
+    output = {
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'hash'      : cmdargs.hash_name,
+        'jobs'      : cmdargs.jobs,
+        'repeat'    : cmdargs.repeat,
+        'stub_par2' : (not cmdargs.real_par2),
+        'tree'      : tree,
+        'results'   : results,
+    }
+
+    if cmdargs.output is None:
+        print(json.dumps(output, indent = 4))
+    else:
+        with open(cmdargs.output, 'wt', encoding = 'utf-8') as f:
+            json.dump(output, f, indent = 4)
+
+if __name__ == '__main__':
+    main()
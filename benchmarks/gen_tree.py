@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import random
+
+from rik.path_constraints import parse_size
+
+SIZE_DISTRIBUTIONS = [ 'fixed', 'uniform', 'lognormal' ]
+
+# Spread of the lognormal size distribution (sigma of the underlying normal)
+LOGNORMAL_SIGMA = 1.5
+
+# Data written to the generated files is taken from a shared random pool
+DATA_POOL_SIZE = 4 * 1024 * 1024
+
+def add_tree_args(parser):
+    parser.add_argument(
+        '--depth',
+        default = 3,
+        dest    = 'depth',
+        help    = 'Depth of the directory tree',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--fanout',
+        default = 4,
+        dest    = 'fanout',
+        help    = 'Number of subdirectories of each directory',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--files',
+        default = 16,
+        dest    = 'files_per_dir',
+        help    = 'Number of files in each directory',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--file-size',
+        default = '64k',
+        dest    = 'file_size',
+        help    = 'Mean file size',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--size-dist',
+        choices = SIZE_DISTRIBUTIONS,
+        default = 'lognormal',
+        dest    = 'size_dist',
+        help    = 'Distribution of file sizes',
+    )
+
+    parser.add_argument(
+        '--hardlinks',
+        default = 0.0,
+        dest    = 'hardlinks',
+        help    = 'Fraction of files that are hard links to other files',
+        type    = float,
+    )
+
+    parser.add_argument(
+        '--seed',
+        default = 0,
+        dest    = 'seed',
+        help    = 'Random seed',
+        type    = int,
+    )
+
+def get_tree_config(cmdargs):
+    return {
+        'depth'         : cmdargs.depth,
+        'fanout'        : cmdargs.fanout,
+        'files_per_dir' : cmdargs.files_per_dir,
+        'file_size'     : cmdargs.file_size,
+        'size_dist'     : cmdargs.size_dist,
+        'hardlinks'     : cmdargs.hardlinks,
+        'seed'          : cmdargs.seed,
+    }
+
+def draw_size(rng, size_dist, mean_size):
+    if size_dist == 'fixed':
+        return mean_size
+
+    if size_dist == 'uniform':
+        return rng.randint(0, 2 * mean_size)
+
+    if size_dist == 'lognormal':
+        # NOTE: mu is chosen so that the mean of the distribution is kept
+        mu = -LOGNORMAL_SIGMA**2 / 2
+        return int(mean_size * rng.lognormvariate(mu, LOGNORMAL_SIGMA))
+
+    raise ValueError(f"Unknown size distribution: '{size_dist}'")
+
+def write_file(path, size, pool, rng):
+    with open(path, 'wb') as f:
+        while size > 0:
+            n      = min(size, len(pool))
+            offset = rng.randint(0, len(pool) - n)
+
+            f.write(pool[offset:offset + n])
+            size -= n
+
+def generate_tree(
+    root, depth = 3, fanout = 4, files_per_dir = 16, file_size = 64 * 1024,
+    size_dist = 'lognormal', hardlinks = 0.0, seed = 0
+):
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    rng   = random.Random(seed)
+    pool  = rng.randbytes(DATA_POOL_SIZE)
+    files = []
+    stats = { 'dirs' : 0, 'files' : 0, 'links' : 0, 'bytes' : 0 }
+    stack = [ (root, 0) ]
+
+    while stack:
+        path, level = stack.pop()
+        os.makedirs(path, exist_ok = True)
+        stats['dirs'] += 1
+
+        for idx in range(files_per_dir):
+            file_path = os.path.join(path, f'file_{idx:05d}')
+
+            if files and (rng.random() < hardlinks):
+                target = rng.choice(files)
+                os.link(target, file_path)
+                stats['links'] += 1
+                size = os.path.getsize(target)
+            else:
+                size = draw_size(rng, size_dist, file_size)
+                write_file(file_path, size, pool, rng)
+                files.append(file_path)
+
+            stats['files'] += 1
+            stats['bytes'] += size
+
+        if level < depth:
+            for idx in range(fanout):
+                stack.append((os.path.join(path, f'dir_{idx:03d}'), level + 1))
+
+    return stats
+
+def parse_cmdargs():
+    parser = argparse.ArgumentParser(
+        description = "Generate a synthetic directory tree for benchmarks"
+    )
+
+    add_tree_args(parser)
+
+    parser.add_argument(
+        'root',
+        help    = 'Directory to create the tree in',
+        metavar = 'DIR',
+    )
+
+    return parser.parse_args()
+
+def main():
+    cmdargs = parse_cmdargs()
+    stats   = generate_tree(cmdargs.root, **get_tree_config(cmdargs))
+
+    print(json.dumps(stats))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import asyncio
+import collections
+import queue
+import threading
+
+from .funcs import build_constraints, walk_filesystem
+from .sinks import ResultSink
+
+# Results produced, but not consumed yet, after which the walk waits for the
+# consumer
+STREAM_QUEUE_SIZE = 1024
+
+# Interval of checks whether a cancelled walk has finished [s]
+STREAM_JOIN_INTERVAL = 0.1
+
+FileResult = collections.namedtuple(
+    'FileResult', [ 'path', 'result', 'details' ]
+)
+
+STREAM_END = object()
+
+class StreamSink(ResultSink):
+    # NOTE: passes results to a bounded queue. A full queue blocks the
+    #       workers until the consumer catches up. Results of a cancelled
+    #       stream are dropped.
+
+    def __init__(self, result_queue, cancel):
+        super().__init__()
+        self._queue  = result_queue
+        self._cancel = cancel
+        self._notify = None
+
+    def set_notify(self, notify):
+        # NOTE: `notify` is called from the worker threads after each put
+        self._notify = notify
+
+    def _put(self, item):
+        if self._cancel.is_set():
+            return
+
+        self._queue.put(item)
+
+        if self._notify is not None:
+            self._notify()
+
+    def add(self, path, result, details = None):
+        super().add(path, result, details)
+        self._put(FileResult(path, result, details))
+
+    def close(self):
+        self._put(STREAM_END)
+
+class ResultStream:
+    # NOTE: walks a directory tree in a background thread and yields a
+    #       FileResult for every file as soon as it is done. Can be iterated
+    #       either synchronously or with `async for`, but only once.
+    #
+    #       Cancellation stops the walk before the next directory. Files of
+    #       the directories already started are still processed and their
+    #       integrities saved, but their results are dropped.
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self, root_dir, integrity, dir_constraints, file_constraints,
+        create = False, prune = False, verify = False, jobs = 1,
+        stats = None, max_queued = STREAM_QUEUE_SIZE
+    ):
+        # pylint: disable=too-many-arguments
+        self._root_dir = root_dir
+        self._queue    = queue.Queue(max_queued)
+        self._cancel   = threading.Event()
+        self._sink     = StreamSink(self._queue, self._cancel)
+        self._thread   = None
+        self._error    = None
+        self._done     = False
+        self._ready    = None
+
+        # NOTE: a clone, so that one integrity can serve several streams
+        #       without being set up again
+        self._walk_args = (
+            root_dir, integrity.clone(), dir_constraints, file_constraints,
+            create, prune, verify, jobs, self._sink, None, stats,
+            self._cancel
+        )
+
+    @property
+    def counts(self):
+        return self._sink.counts
+
+    @property
+    def counters(self):
+        return self._sink.counters
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _run(self):
+        # pylint: disable=broad-except
+        try:
+            walk_filesystem(*self._walk_args)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._sink.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(
+            target = self._run, name = 'rik-stream', daemon = True
+        )
+        self._thread.start()
+
+    def _finish(self, item):
+        if item is not STREAM_END:
+            return False
+
+        self._done = True
+        self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.start()
+
+        if self._done:
+            raise StopIteration
+
+        item = self._queue.get()
+
+        if self._finish(item):
+            raise StopIteration
+
+        return item
+
+    def cancel(self):
+        # NOTE: blocks until the directories in flight are finished
+        self._cancel.set()
+
+        if self._thread is None:
+            self._done = True
+            return
+
+        # NOTE: drains the queue, so that workers waiting for space in it
+        #       see the cancellation
+        while self._thread.is_alive():
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            self._thread.join(STREAM_JOIN_INTERVAL)
+
+        self._done = True
+
+    def close(self):
+        if not self._done:
+            self.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _set_ready(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # NOTE: the loop is closed, nobody is waiting anymore
+            pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._ready is None:
+            loop        = asyncio.get_running_loop()
+            self._ready = asyncio.Event()
+            self._sink.set_notify(lambda : self._set_ready(loop))
+
+        self.start()
+
+        if self._done:
+            raise StopAsyncIteration
+
+        # NOTE: the event is cleared before polling the queue, so that a
+        #       result put after the poll still wakes this coroutine up
+        while True:
+            self._ready.clear()
+
+            try:
+                item = self._queue.get_nowait()
+                break
+            except queue.Empty:
+                pass
+
+            await self._ready.wait()
+
+        if self._finish(item):
+            raise StopAsyncIteration
+
+        return item
+
+    async def aclose(self):
+        if not self._done:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.cancel
+            )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+def stream_results(
+    root_dir, integrity, create = False, prune = False, verify = False,
+    jobs = 1, excludes = None, size_constraints = None, stats = None,
+    max_queued = STREAM_QUEUE_SIZE
+):
+    # NOTE: library entry point. `integrity` is made with `select_integrity`
+    #       once and may be reused by any number of streams. E.g.
+    #
+    #         with stream_results(root, integrity, verify = True) as results:
+    #             for (path, result, details) in results:
+    #                 ...
+    # pylint: disable=too-many-arguments
+    dir_constraints, file_constraints = build_constraints(
+        excludes, size_constraints
+    )
+
+    return ResultStream(
+        root_dir, integrity, dir_constraints, file_constraints,
+        create, prune, verify, jobs, stats, max_queued
+    )
@@ -3,6 +3,11 @@ RESULT_OK       = 0
 RESULT_NEW      = 1
 RESULT_DEL      = 2
 RESULT_SKIP     = 3
+RESULT_DEFER    = 4
 RESULT_ERROR    = -1
 RESULT_MISMATCH = -2
 
+COUNTER_PRUNED_DIRS  = 'pruned_dirs'
+COUNTER_CACHE_HITS   = 'digest_cache_hits'
+COUNTER_CACHE_MISSES = 'digest_cache_misses'
+
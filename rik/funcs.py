@@ -1,58 +1,209 @@
+import collections
+import concurrent.futures
 import logging
 import os
+import time
 
 from .consts import (
     RESULT_OK, RESULT_NEW, RESULT_ERROR, RESULT_MISMATCH, RESULT_SKIP,
-    RESULT_DEL
+    RESULT_DEL, RESULT_DEFER, COUNTER_PRUNED_DIRS, COUNTER_CACHE_HITS,
+    COUNTER_CACHE_MISSES
 )
 from .integrity.par2 import (
     Par2Integrity, PAR2_STORAGE_NAME, PAR2_DEFAULT_ARGS
 )
+from .integrity.par2_profiles import override_par2_args
 from .integrity.hash import (
-    HashIntegrity, SUPPORTED_HASHES, HASH_STORAGE_NAMES
+    HashIntegrity, SUPPORTED_HASHES, HASH_STORAGE_NAMES, HASH_STORAGE_PREFIX
+)
+from .integrity.catalog import CatalogHashIntegrity
+from .integrity.multi_hash import (
+    MultiHashIntegrity, HASH_NAME_SEPARATOR, parse_hash_names
+)
+from .integrity.block_hash import (
+    BlockHashIntegrity, MERKLE_BLOCK_SIZE, MERKLE_STORAGE_NAMES,
+    is_merkle_name, parse_merkle_name
+)
+from .journal          import DirectorySink
+from .path_constraints import (
+    PathConstraint, ConstraintSet, GlobConstraint, FileSizeConstraint
+)
+from .path_entry       import PathEntry, walk_entries
+from .sinks            import SummarySink
+from .stats            import (
+    timed, timed_iter, PHASE_WALK, PHASE_LOAD, PHASE_FILE, PHASE_FLUSH,
+    PHASE_PRUNE, PHASE_SAVE, SLOWEST_FILES, SLOWEST_DIRECTORIES
 )
 
 LOGGER = logging.getLogger('rik')
 
-DEFAULT_EXCLUDES = [ PAR2_STORAGE_NAME, ] + HASH_STORAGE_NAMES
+# Number of directories that may have files in flight per worker
+PARALLEL_DIR_WINDOW = 4
+
+DEFAULT_EXCLUDES = (
+    [ PAR2_STORAGE_NAME, ] + HASH_STORAGE_NAMES + MERKLE_STORAGE_NAMES
+)
+
+def check_hash_names(hash_names):
+    for hash_name in hash_names:
+        if hash_name not in SUPPORTED_HASHES:
+            raise RuntimeError(f"Unknown hash: '{hash_name}'")
+
+def create_par2_integrity(iargs, catalog, par2_profiles, **kwargs):
+    if catalog is not None:
+        raise RuntimeError("Catalog is supported only by hash integrities")
 
-def select_integrity(name, writable, recalc, verbosity, iargs = None):
-    iargs  = iargs or []
+    # NOTE: arguments given by the user override the default ones
+    if par2_profiles is None:
+        par2_args = override_par2_args(PAR2_DEFAULT_ARGS, iargs)
+    else:
+        par2_args = iargs
+
+    return Par2Integrity(
+        par2_args = par2_args, profiles = par2_profiles, **kwargs
+    )
+
+def create_merkle_integrity(name, catalog, **kwargs):
+    if catalog is not None:
+        raise RuntimeError("Catalog is not supported by merkle integrities")
+
+    hash_name = parse_merkle_name(name)
+    check_hash_names([ hash_name, ])
+
+    return BlockHashIntegrity(hash_name = hash_name, **kwargs)
+
+def select_integrity(
+    name, writable, recalc, verbosity, iargs = None, jobs = 1,
+    metadata = False, quick = False, reader = None, catalog = None,
+    par2_batch_size = 0, cache = None, throttle = None, stats = None,
+    block_size = MERKLE_BLOCK_SIZE, par2_profiles = None
+):
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
     kwargs = {
         'writable' : writable,
         'recalc'   : recalc,
         'verbose'  : (verbosity > 1),
     }
+    hash_kwargs = {
+        'metadata' : metadata,
+        'quick'    : quick,
+        'reader'   : reader,
+        'cache'    : cache,
+        **kwargs
+    }
 
     if name == 'par2':
-        integrity = Par2Integrity(
-            par2_args = (PAR2_DEFAULT_ARGS + iargs), **kwargs
+        integrity = create_par2_integrity(
+            iargs or [], catalog, par2_profiles,
+            jobs       = jobs,
+            batch_size = par2_batch_size,
+            throttle   = throttle,
+            stats      = stats,
+            **kwargs
         )
 
     elif name in SUPPORTED_HASHES:
-        integrity = HashIntegrity(hash_name = name, **kwargs)
+        if catalog is not None:
+            integrity = CatalogHashIntegrity(
+                catalog = catalog, hash_name = name, **hash_kwargs
+            )
+        else:
+            integrity = HashIntegrity(hash_name = name, **hash_kwargs)
+
+    elif is_merkle_name(name):
+        integrity = create_merkle_integrity(
+            name, catalog,
+            block_size = block_size,
+            reader     = reader,
+            jobs       = jobs,
+            **kwargs
+        )
+
+    elif HASH_NAME_SEPARATOR in name:
+        hash_names = parse_hash_names(name)
+        check_hash_names(hash_names)
+
+        integrity = MultiHashIntegrity(
+            hash_names = hash_names, catalog = catalog, **hash_kwargs
+        )
 
     else:
         raise RuntimeError(f"Unknown integrity type: '{name}'")
 
     return integrity
 
-def check_constraints(path, constraints):
-    for constraint in constraints:
-        if not constraint.check(path):
-            LOGGER.debug("Path '%s' fails constraints. Skipping.", path)
-            return False
+def build_constraints(excludes = None, size_constraints = None):
+    # NOTE: returns compiled (directory, file) constraints. Storages of all
+    #       integrities are always excluded.
+    constraints =  [ GlobConstraint(x, True) for x in DEFAULT_EXCLUDES ]
+    constraints += [ GlobConstraint(x, True) for x in (excludes or []) ]
+
+    dir_constraints  = constraints
+    file_constraints = constraints + [
+        FileSizeConstraint.from_string(x) for x in (size_constraints or [])
+    ]
+
+    return (ConstraintSet(dir_constraints), ConstraintSet(file_constraints))
+
+def check_constraints(entry, constraints):
+    # NOTE: `constraints` is either a single (e.g. compiled) constraint or
+    #       a list of them
+    if isinstance(constraints, PathConstraint):
+        passed = constraints.check(entry)
+    else:
+        passed = all(x.check(entry) for x in constraints)
+
+    if not passed:
+        LOGGER.debug("Path '%s' fails constraints. Skipping.", entry.path)
+
+    return passed
+
+def prune_directories(dirs, constraints):
+    # NOTE: modifies `dirs` in place to keep the walk out of excluded subtrees
+    n_dirs  = len(dirs)
+    dirs[:] = [ x for x in dirs if check_constraints(x, constraints) ]
+
+    return n_dirs - len(dirs)
+
+def walk_directories(root_dir, dir_constraints, sink, shard = None):
+    # NOTE: with a `shard`, pruned subtrees are counted only by the shard
+    #       that owns their parent, so that merged counts match a full run
+    for root_entry, dirs, files in walk_entries(PathEntry(root_dir)):
+        owned = (shard is None) or shard.owns(root_entry.path)
 
-    return True
+        # NOTE: subdirectories are pruned before descent, so only the
+        #       walk root itself can fail the constraints here
+        if not check_constraints(root_entry, dir_constraints):
+            dirs[:] = []
+
+            if owned:
+                sink.count(COUNTER_PRUNED_DIRS)
+
+            continue
+
+        n_pruned = prune_directories(dirs, dir_constraints)
+
+        if owned:
+            sink.count(COUNTER_PRUNED_DIRS, n_pruned)
+
+        yield (root_entry, files)
+
+def verify_integrity(entry, integrity, sink, previous = None):
+    # NOTE: `previous` are details of an earlier failed verification. If
+    #       given, the integrity may recheck only the failed parts.
+    file_path = entry.path
 
-def verify_integrity(file_name, file_path, integrity, result_dict):
     try:
-        result = integrity.verify(file_name)
+        if previous is None:
+            result = integrity.verify(entry.name, entry)
+        else:
+            result = integrity.reverify(entry.name, previous, entry)
     except OSError as e:
         LOGGER.error(e)
         result = RESULT_ERROR
 
-    result_dict[file_path] = result
+    sink.add(file_path, result, integrity.get_details(entry.name))
 
     if result == RESULT_MISMATCH:
         LOGGER.warning("Integrity mismatch for: '%s'", file_path)
@@ -65,14 +216,23 @@ def verify_integrity(file_name, file_path, integrity, result_dict):
     else:
         LOGGER.error("Unknown return code '%d' for '%s'", result, file_path)
 
-def create_integrity(file_name, file_path, integrity, result_dict):
+def create_integrity(entry, integrity, sink):
+    file_path = entry.path
+
     try:
-        result = integrity.calculate(file_name)
+        result = integrity.calculate(entry.name, entry)
     except OSError as e:
         LOGGER.error(e)
         result = RESULT_ERROR
 
-    result_dict[file_path] = result
+    if result == RESULT_DEFER:
+        LOGGER.debug("Integrity creation for '%s' is deferred", file_path)
+        return
+
+    report_created(file_path, result, sink)
+
+def report_created(file_path, result, sink):
+    sink.add(file_path, result)
 
     if result == RESULT_ERROR:
         LOGGER.warning("Failed to create integrity for: %s", file_path)
@@ -84,92 +244,340 @@ def create_integrity(file_name, file_path, integrity, result_dict):
         LOGGER.error("Unknown return code '%d' for %s", result, file_path)
 
 def handle_file(
-    file_name, file_path, integrity, constraints, result_dict,
-    create = False, verify = False
+    entry, integrity, constraints, sink, create = False, verify = False,
+    stats = None
 ):
     # pylint: disable=too-many-arguments
 
-    if not os.path.isfile(file_path):
-        LOGGER.debug("Path '%s' is not a file. Skipping.", file_path)
+    if not entry.is_file():
+        LOGGER.debug("Path '%s' is not a file. Skipping.", entry.path)
         return
 
     if (not create) and (not verify):
-        integrity.mark_as_seen(file_name)
+        integrity.mark_as_seen(entry.name)
         return
 
-    if not check_constraints(file_path, constraints):
-        result_dict[file_path] = RESULT_SKIP
+    if not check_constraints(entry, constraints):
+        sink.add(entry.path, RESULT_SKIP)
         return
 
-    if create:
-        create_integrity(file_name, file_path, integrity, result_dict)
+    with timed(stats, PHASE_FILE, entry.path, SLOWEST_FILES):
+        if create:
+            create_integrity(entry, integrity, sink)
 
-    if verify:
-        verify_integrity(file_name, file_path, integrity, result_dict)
+        if verify:
+            verify_integrity(entry, integrity, sink)
 
-def walk_filesystem(
-    root_dir, integrity, dir_constraints, file_constraints,
-    create, prune, verify
+class SerialExecutor(concurrent.futures.Executor):
+    # NOTE: runs submitted calls immediately in the caller thread
+
+    def submit(self, fn, *args, **kwargs):
+        # pylint: disable=arguments-differ
+        # pylint: disable=broad-except
+        future = concurrent.futures.Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+        return future
+
+def create_executor(jobs):
+    if jobs > 1:
+        return concurrent.futures.ThreadPoolExecutor(max_workers = jobs)
+
+    return SerialExecutor()
+
+def finalize_directory(
+    root, integrity, futures, prune, save, sink, stats = None
 ):
     # pylint: disable=too-many-arguments
-    result_dict = {}
+    for future in futures:
+        future.result()
 
-    for root, _dirs, files in os.walk(root_dir):
+    try:
+        with timed(stats, PHASE_FLUSH):
+            for (file_name, result) in integrity.flush():
+                report_created(os.path.join(root, file_name), result, sink)
+    except OSError as e:
+        LOGGER.error(e)
+        sink.add(root, RESULT_ERROR)
 
-        if not check_constraints(root, dir_constraints):
-            continue
+    if prune:
+        with timed(stats, PHASE_PRUNE):
+            for file_path in integrity.prune():
+                LOGGER.info("Pruned: '%s'", file_path)
+                sink.add(file_path, RESULT_DEL)
 
-        LOGGER.info("Processing directory '%s'", root)
+    if save:
         try:
-            integrity.load(root)
+            with timed(stats, PHASE_SAVE):
+                integrity.save()
         except IOError:
-            result_dict[root] = RESULT_ERROR
-            continue
+            sink.add(root, RESULT_ERROR)
+
+def finalize_pending(pending, prune, save, journal, stats):
+    # pylint: disable=too-many-arguments
+    root, integrity, futures, dir_sink, start = pending.popleft()
+
+    finalize_directory(root, integrity, futures, prune, save, dir_sink, stats)
+
+    if journal is not None:
+        journal.add_directory(root, dir_sink.results)
 
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            handle_file(
-                file_name, file_path, integrity, file_constraints, result_dict,
-                create, verify
+    # NOTE: directory time is the wall time from its loading to saving,
+    #       which includes waiting for other directories in parallel runs
+    if stats is not None:
+        stats.add_slowest(
+            SLOWEST_DIRECTORIES, root, time.perf_counter() - start
+        )
+
+def walk_filesystem(
+    root_dir, integrity, dir_constraints, file_constraints,
+    create, prune, verify, jobs = 1, sink = None, journal = None,
+    stats = None, cancel = None, shard = None
+):
+    # NOTE: if the `cancel` event is set, no more directories are started.
+    #       Directories in flight are still finished and saved. With a
+    #       `shard`, only the directories it owns are processed.
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    pending     = collections.deque()
+    max_pending = PARALLEL_DIR_WINDOW * jobs if jobs > 1 else 0
+    save        = (create or prune)
+
+    if sink is None:
+        sink = SummarySink()
+
+    with create_executor(jobs) as executor:
+        for root_entry, files in timed_iter(
+            walk_directories(root_dir, dir_constraints, sink, shard),
+            stats, PHASE_WALK
+        ):
+            if (cancel is not None) and cancel.is_set():
+                LOGGER.info("Walk of '%s' is cancelled", root_dir)
+                break
+
+            root  = root_entry.path
+            start = time.perf_counter()
+
+            if (shard is not None) and (not shard.owns(root)):
+                LOGGER.debug("Directory '%s' is in another shard", root)
+                continue
+
+            if (journal is not None) and journal.is_completed(root):
+                LOGGER.debug("Directory '%s' is already done. Skipping.", root)
+                continue
+
+            LOGGER.info("Processing directory '%s'", root)
+
+            # NOTE: each directory in flight needs its own integrity state
+            dir_integrity = integrity.clone() if jobs > 1 else integrity
+            dir_sink      = (
+                DirectorySink(sink) if (journal is not None) else sink
             )
 
-        if prune:
-            for file_path in integrity.prune():
-                LOGGER.info("Pruned: '%s'", file_path)
-                result_dict[file_path] = RESULT_DEL
+            try:
+                with timed(stats, PHASE_LOAD):
+                    dir_integrity.load(root)
+            except IOError:
+                sink.add(root, RESULT_ERROR)
+                continue
 
-        if create or prune:
+            futures = [
+                executor.submit(
+                    handle_file,
+                    entry, dir_integrity, file_constraints, dir_sink,
+                    create, verify, stats
+                )
+                for entry in files
+            ]
+
+            pending.append((root, dir_integrity, futures, dir_sink, start))
+
+            while len(pending) > max_pending:
+                finalize_pending(pending, prune, save, journal, stats)
+
+        while pending:
+            finalize_pending(pending, prune, save, journal, stats)
+
+    return sink
+
+def repair_file(entry, integrity, sink, details, stats = None):
+    file_path = entry.path
+
+    with timed(stats, PHASE_FILE, file_path, SLOWEST_FILES):
+        if integrity.can_repair:
             try:
-                integrity.save()
+                result = integrity.repair(entry.name)
+            except OSError as e:
+                LOGGER.error(e)
+                result = RESULT_ERROR
+
+            if result != RESULT_OK:
+                LOGGER.warning("Failed to repair: '%s'", file_path)
+                sink.add(file_path, result)
+                return
+
+            LOGGER.info("Repaired: '%s'", file_path)
+
+        verify_integrity(entry, integrity, sink, details or {})
+
+def repair_files(failures, integrity, jobs = 1, sink = None, stats = None):
+    # NOTE: `failures` maps paths of files that failed verification to the
+    #       details of their results. Only these files are repaired and
+    #       verified again, without walking the rest of the tree.
+    if sink is None:
+        sink = SummarySink()
+
+    directories = collections.defaultdict(list)
+
+    for (file_path, details) in failures.items():
+        directories[os.path.dirname(file_path)].append((file_path, details))
+
+    futures = []
+
+    with create_executor(jobs) as executor:
+        for root in sorted(directories):
+            dir_integrity = integrity.clone() if jobs > 1 else integrity
+
+            file_names = [
+                os.path.basename(x) for (x, _) in directories[root]
+            ]
+
+            try:
+                with timed(stats, PHASE_LOAD):
+                    dir_integrity.load(root, file_names)
             except IOError:
-                result_dict[root] = RESULT_ERROR
+                sink.add(root, RESULT_ERROR)
+                continue
+
+            futures += [
+                executor.submit(
+                    repair_file,
+                    PathEntry(file_path), dir_integrity, sink, details, stats
+                )
+                for (file_path, details) in sorted(directories[root])
+            ]
+
+        for future in futures:
+            future.result()
+
+    return sink
+
+def transfer_integrity(source, target, root):
+    try:
+        source.load(root)
+        target.load(root)
+    except (IOError, RuntimeError) as e:
+        LOGGER.error(e)
+        return RESULT_ERROR
+
+    for file_name in source.known_files:
+        target.set_digest(
+            file_name,
+            source.get_digest(file_name),
+            source.get_stored_stat(file_name)
+        )
+        target.mark_as_seen(file_name)
+
+    target.prune()
+
+    try:
+        target.save()
+    except IOError as e:
+        LOGGER.error(e)
+        return RESULT_ERROR
+
+    return RESULT_OK
+
+def import_catalog(
+    root_dir, hash_names, catalog, dir_constraints, sink = None
+):
+    if sink is None:
+        sink = SummarySink()
+
+    transfers = [
+        (
+            HASH_STORAGE_PREFIX + x,
+            HashIntegrity(hash_name = x),
+            CatalogHashIntegrity(
+                catalog = catalog, hash_name = x, writable = True
+            ),
+        )
+        for x in hash_names
+    ]
+
+    for root_entry, files in walk_directories(
+        root_dir, dir_constraints, sink
+    ):
+        root       = root_entry.path
+        file_names = set(x.name for x in files)
+
+        for (storage_name, source, target) in transfers:
+            if storage_name not in file_names:
+                continue
+
+            storage_path = os.path.join(root, storage_name)
+
+            LOGGER.info("Importing '%s'", storage_path)
+            sink.add(storage_path, transfer_integrity(source, target, root))
+
+    return sink
+
+def export_catalog(root_dir, hash_names, catalog, sink = None):
+    if sink is None:
+        sink = SummarySink()
+
+    for hash_name in hash_names:
+        storage_name = HASH_STORAGE_PREFIX + hash_name
+        source = CatalogHashIntegrity(catalog = catalog, hash_name = hash_name)
+        target = HashIntegrity(hash_name = hash_name, writable = True)
+
+        for root in catalog.get_directories(hash_name, root_dir):
+            storage_path = os.path.join(root, storage_name)
+
+            if not os.path.isdir(root):
+                LOGGER.warning("Directory '%s' does not exist", root)
+                sink.add(storage_path, RESULT_ERROR)
                 continue
 
-    return result_dict
+            LOGGER.info("Exporting '%s'", storage_path)
+            sink.add(storage_path, transfer_integrity(source, target, root))
+
+    return sink
 
-def print_summary_block(result_dict, value, title):
-    matching_files = [ k for (k, v) in result_dict.items() if v == value ]
+def print_summary_block(sink, value, title):
+    matching_files = sink.get_entries(value)
 
     if matching_files:
         print('    ', title)
         for file_path in matching_files:
             print('    ', '    ', file_path)
 
-    return len(matching_files)
+    return sink.counts[value]
 
-def print_summary(result_dict):
+def print_summary(sink):
     print("SUMMARY")
 
-    n_ok   = print_summary_block(result_dict, RESULT_OK,       "Successful")
-    n_new  = print_summary_block(result_dict, RESULT_NEW,      "New")
-    n_del  = print_summary_block(result_dict, RESULT_DEL,      "Removed")
-    n_skip = print_summary_block(result_dict, RESULT_SKIP,     "Skipped")
-    n_err  = print_summary_block(result_dict, RESULT_ERROR,    "Error")
-    n_mis  = print_summary_block(result_dict, RESULT_MISMATCH, "Mismatch")
+    n_ok   = print_summary_block(sink, RESULT_OK,       "Successful")
+    n_new  = print_summary_block(sink, RESULT_NEW,      "New")
+    n_del  = print_summary_block(sink, RESULT_DEL,      "Removed")
+    n_skip = print_summary_block(sink, RESULT_SKIP,     "Skipped")
+    n_err  = print_summary_block(sink, RESULT_ERROR,    "Error")
+    n_mis  = print_summary_block(sink, RESULT_MISMATCH, "Mismatch")
 
     print(
-        f"\nTotal: {len(result_dict)}."
+        f"\nTotal: {sink.n_total}."
         f" OK: {n_ok}. NEW: {n_new}. DEL: {n_del}."
         f" SKIP: {n_skip}. FAIL: {n_mis}. ERROR: {n_err}."
     )
+    print(f"Pruned directories: {sink.counters[COUNTER_PRUNED_DIRS]}.")
+
+    if COUNTER_CACHE_HITS in sink.counters:
+        print(
+            f"Digest cache: {sink.counters[COUNTER_CACHE_HITS]} hits,"
+            f" {sink.counters[COUNTER_CACHE_MISSES]} misses."
+        )
 
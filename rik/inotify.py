@@ -0,0 +1,114 @@
+import collections
+import ctypes
+import errno
+import os
+import platform
+import select
+import struct
+
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_DONT_FOLLOW  = 0x02000000
+IN_EXCL_UNLINK  = 0x04000000
+IN_ISDIR        = 0x40000000
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT_HEADER = struct.Struct('iIII')
+
+# Enough for hundreds of events with long names per read
+EVENT_BUFFER_SIZE = 256 * 1024
+
+InotifyEvent = collections.namedtuple(
+    'InotifyEvent', [ 'wd', 'mask', 'cookie', 'name' ]
+)
+
+def parse_events(data):
+    result = []
+    offset = 0
+
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+
+        name    = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+
+        result.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+
+    return result
+
+class Inotify:
+    # NOTE: inotify has no wrapper in the standard library, so it is called
+    #       through libc. The descriptor is non-blocking and waited on with
+    #       `select`, which allows to wake up for timeouts.
+
+    def __init__(self):
+        if platform.system() != 'Linux':
+            raise RuntimeError("inotify is supported only on Linux")
+
+        self._libc = ctypes.CDLL(None, use_errno = True)
+        self._libc.inotify_init1.argtypes     = [ ctypes.c_int ]
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        self._libc.inotify_rm_watch.argtypes  = [ ctypes.c_int, ctypes.c_int ]
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self._fd < 0:
+            self._raise_error("Failed to initialize inotify")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _raise_error(message, path = None):
+        code = ctypes.get_errno()
+
+        if code == errno.ENOSPC:
+            message += " (see sysctl fs.inotify.max_user_watches)"
+
+        raise OSError(code, f"{message}: {os.strerror(code)}", path)
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            self._raise_error("Failed to watch directory", path)
+
+        return wd
+
+    def rm_watch(self, wd):
+        # NOTE: fails if the watch is already gone with its directory
+        return self._libc.inotify_rm_watch(self._fd, wd) == 0
+
+    def read(self, timeout = None):
+        # NOTE: returns an empty list if no events arrive within `timeout`
+        #       seconds, or waits for them forever if it is None
+        ready, _, _ = select.select([ self._fd ], [], [], timeout)
+
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self._fd, EVENT_BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+
+        return parse_events(data)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,357 @@
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import os
+
+from ..consts   import RESULT_OK, RESULT_MISMATCH, RESULT_ERROR
+from .hash import (
+    SUPPORTED_HASHES, HASH_STORAGE_PREFIX, HASH_SEPARATOR, STAT_SEPARATOR,
+    escape_path, unescape_path
+)
+from .hashers   import KNOWN_HASHES, new_hasher
+from .integrity import Integrity
+from .reader    import FileReader
+from .storage   import get_storage_names, write_atomic, remove_file, read_lines
+
+LOGGER = logging.getLogger('rik')
+
+MERKLE_PREFIX         = 'merkle-'
+MERKLE_STORAGE_PREFIX = HASH_STORAGE_PREFIX + 'merkle_'
+MERKLE_STORAGE_NAMES  = [
+    y for x in KNOWN_HASHES
+        for y in get_storage_names(MERKLE_STORAGE_PREFIX + x)
+]
+MERKLE_INTEGRITIES    = [ MERKLE_PREFIX + x for x in SUPPORTED_HASHES ]
+
+MERKLE_BLOCK_SIZE = 64 * 1024 * 1024
+MERKLE_NODE_TAG   = b'\x01'
+BLOCK_SEPARATOR   = ','
+NO_BLOCKS         = '-'
+
+BlockManifest = collections.namedtuple(
+    'BlockManifest', [ 'root', 'size', 'block_size', 'blocks' ]
+)
+
+def is_merkle_name(name):
+    return name.startswith(MERKLE_PREFIX)
+
+def parse_merkle_name(name):
+    return name[len(MERKLE_PREFIX):]
+
+def get_block_ranges(size, block_size):
+    return [
+        (offset, min(block_size, size - offset))
+            for offset in range(0, size, block_size)
+    ]
+
+def calc_merkle_root(hash_name, blocks):
+    # NOTE: leaves are plain digests of the blocks, so that a block can be
+    #       checked with standard tools. Inner nodes hash the tagged
+    #       concatenation of their children. An odd node is moved up as is.
+    level = [ bytes.fromhex(x) for x in blocks ]
+
+    if not level:
+        return new_hasher(hash_name).hexdigest()
+
+    while len(level) > 1:
+        parents = []
+
+        for idx in range(0, len(level) - 1, 2):
+            parents.append(new_hasher(
+                hash_name, MERKLE_NODE_TAG + level[idx] + level[idx + 1]
+            ).digest())
+
+        if len(level) % 2 == 1:
+            parents.append(level[-1])
+
+        level = parents
+
+    return level[0].hex()
+
+def find_damaged_blocks(expected, actual):
+    n_blocks = max(len(expected.blocks), len(actual.blocks))
+
+    return [
+        idx for idx in range(n_blocks)
+            if (idx >= len(expected.blocks)) or (idx >= len(actual.blocks))
+            or (expected.blocks[idx] != actual.blocks[idx])
+    ]
+
+def blocks_to_ranges(blocks, block_size, size):
+    # NOTE: merges adjacent blocks into [start, end) byte ranges
+    result = []
+
+    for idx in blocks:
+        start = idx * block_size
+        end   = min(start + block_size, size)
+
+        if result and (result[-1][1] == start):
+            result[-1][1] = end
+        else:
+            result.append([ start, end ])
+
+    return result
+
+def ranges_to_blocks(ranges, block_size):
+    result = set()
+
+    for (start, end) in ranges:
+        result.update(range(start // block_size, -(-end // block_size)))
+
+    return sorted(result)
+
+def format_ranges(ranges):
+    return ', '.join(f"{start}-{end - 1}" for (start, end) in ranges)
+
+def format_manifest(manifest):
+    blocks = BLOCK_SEPARATOR.join(manifest.blocks) or NO_BLOCKS
+
+    return HASH_SEPARATOR.join([
+        manifest.root,
+        f"{manifest.size}{STAT_SEPARATOR}{manifest.block_size}",
+        blocks,
+    ])
+
+def parse_manifest(line):
+    tokens = line.split(HASH_SEPARATOR, 3)
+
+    if len(tokens) != 4:
+        raise RuntimeError(f"Failed to parse block manifest: '{line}'")
+
+    root, sizes, blocks, fname = tokens
+    sizes = sizes.split(STAT_SEPARATOR)
+
+    if len(sizes) != 2:
+        raise RuntimeError(f"Failed to parse block manifest: '{line}'")
+
+    if blocks == NO_BLOCKS:
+        blocks = []
+    else:
+        blocks = blocks.split(BLOCK_SEPARATOR)
+
+    manifest = BlockManifest(root, int(sizes[0]), int(sizes[1]), blocks)
+
+    return (unescape_path(fname), manifest)
+
+class BlockHashIntegrity(Integrity):
+    # NOTE: stores a digest of every block of a file and the root of the
+    #       Merkle tree built over them. Blocks of a large file are hashed
+    #       in parallel, and a mismatch is narrowed down to damaged blocks.
+
+    def __init__(
+        self,
+        hash_name  = None,
+        writable   = False,
+        recalc     = False,
+        verbose    = False,
+        block_size = MERKLE_BLOCK_SIZE,
+        reader     = None,
+        jobs       = 1,
+    ):
+        # pylint: disable=too-many-arguments
+        self._hash_name  = hash_name.lower()
+        self._block_size = block_size
+        self._reader     = reader or FileReader()
+        self._damage     = {}
+        self._executor   = None
+
+        if self._hash_name not in SUPPORTED_HASHES:
+            raise ValueError(f"Unknown hash: '{self._hash_name}'")
+
+        if block_size <= 0:
+            raise ValueError(f"Block size must be positive: '{block_size}'")
+
+        # NOTE: the pool is shared by all clones of this integrity. It is
+        #       separate from the pool processing files, so that a file
+        #       waiting for its blocks never blocks them from running.
+        if jobs > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = jobs
+            )
+
+        super().__init__(
+            MERKLE_STORAGE_PREFIX + self._hash_name, writable, recalc, verbose
+        )
+
+    @property
+    def hash_name(self):
+        return self._hash_name
+
+    def get_manifest(self, file_name):
+        return self._integrity_dict[file_name]
+
+    def get_details(self, file_name):
+        ranges = self._damage.get(file_name, None)
+
+        if ranges is None:
+            return None
+
+        return { 'ranges' : ranges }
+
+    def _load(self):
+        self._damage = {}
+
+        if not os.path.isfile(self._storage_path):
+            return
+
+        for line in read_lines(self._storage_path):
+            file_name, manifest = parse_manifest(line)
+            self._integrity_dict[file_name] = manifest
+
+    def _format_line(self, file_name):
+        manifest = format_manifest(self._integrity_dict[file_name])
+        return f"{manifest}{HASH_SEPARATOR}{escape_path(file_name)}"
+
+    def _save(self):
+        files = sorted(self._integrity_dict.keys())
+
+        if not files:
+            remove_file(self._storage_path)
+            return
+
+        write_atomic(
+            self._storage_path, (self._format_line(x) for x in files)
+        )
+
+    def _hash_block(self, file_path, block):
+        m = new_hasher(self._hash_name)
+
+        with contextlib.closing(
+            self._reader.read(file_path, block[0], block[1])
+        ) as chunks:
+            for chunk in chunks:
+                m.update(chunk)
+
+        return m.hexdigest()
+
+    def _hash_blocks(self, file_path, blocks):
+        if (self._executor is None) or (len(blocks) < 2):
+            return [ self._hash_block(file_path, x) for x in blocks ]
+
+        return list(self._executor.map(
+            lambda x : self._hash_block(file_path, x), blocks
+        ))
+
+    def _calc_manifest(self, file_path, block_size, entry = None):
+        size   = entry.stat().st_size if (entry is not None) \
+            else os.stat(file_path).st_size
+        blocks = self._hash_blocks(
+            file_path, get_block_ranges(size, block_size)
+        )
+
+        return BlockManifest(
+            calc_merkle_root(self._hash_name, blocks), size, block_size,
+            blocks
+        )
+
+    def _calculate(self, file_name, entry):
+        manifest = self._calc_manifest(
+            self._get_file_path(file_name), self._block_size, entry
+        )
+
+        return RESULT_OK, manifest
+
+    def _check_manifest(self, file_name):
+        expected = self._integrity_dict[file_name]
+        root     = calc_merkle_root(self._hash_name, expected.blocks)
+
+        if root != expected.root:
+            LOGGER.error(
+                "Block manifest of '%s' is corrupted",
+                self._get_file_path(file_name)
+            )
+            return None
+
+        return expected
+
+    def _report_damage(self, file_name, ranges):
+        self._damage[file_name] = ranges
+
+        LOGGER.warning(
+            "Damaged byte ranges of '%s': %s",
+            self._get_file_path(file_name), format_ranges(ranges)
+        )
+
+    def _verify(self, file_name, entry):
+        self._damage.pop(file_name, None)
+        expected = self._check_manifest(file_name)
+
+        if expected is None:
+            return RESULT_ERROR
+
+        actual = self._calc_manifest(
+            self._get_file_path(file_name), expected.block_size, entry
+        )
+
+        if actual.root == expected.root:
+            return RESULT_OK
+
+        damaged = find_damaged_blocks(expected, actual)
+        ranges  = blocks_to_ranges(
+            damaged, expected.block_size, max(expected.size, actual.size)
+        )
+
+        self._report_damage(file_name, ranges)
+
+        return RESULT_MISMATCH
+
+    def reverify(self, file_name, details = None, entry = None):
+        ranges = (details or {}).get('ranges', None)
+
+        if (not ranges) or (file_name not in self._integrity_dict):
+            return self.verify(file_name, entry)
+
+        return self.verify_blocks(file_name, ranges)
+
+    def verify_blocks(self, file_name, ranges):
+        # NOTE: re-verifies only the blocks covering the given byte ranges,
+        #       e.g. the ones reported as damaged by an earlier verification
+        self.mark_as_seen(file_name)
+        self._damage.pop(file_name, None)
+        expected = self._check_manifest(file_name)
+
+        if expected is None:
+            return RESULT_ERROR
+
+        file_path = self._get_file_path(file_name)
+        size      = os.stat(file_path).st_size
+
+        if size != expected.size:
+            ranges = blocks_to_ranges(
+                ranges_to_blocks([ (0, max(size, expected.size)) ],
+                expected.block_size),
+                expected.block_size, max(size, expected.size)
+            )
+            self._report_damage(file_name, ranges)
+            return RESULT_MISMATCH
+
+        blocks = [
+            x for x in ranges_to_blocks(ranges, expected.block_size)
+                if x < len(expected.blocks)
+        ]
+        digests = self._hash_blocks(
+            file_path,
+            [ get_block_ranges(size, expected.block_size)[x] for x in blocks ]
+        )
+
+        damaged = [
+            idx for (idx, digest) in zip(blocks, digests)
+                if digest != expected.blocks[idx]
+        ]
+
+        if not damaged:
+            return RESULT_OK
+
+        self._report_damage(
+            file_name, blocks_to_ranges(damaged, expected.block_size, size)
+        )
+
+        return RESULT_MISMATCH
+
+    def _delete(self, file_name):
+        # pylint: disable=no-else-return
+        if file_name in self._integrity_dict:
+            return RESULT_OK
+        else:
+            return RESULT_ERROR
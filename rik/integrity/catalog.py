@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+import time
+
+from ..consts import RESULT_OK, RESULT_ERROR
+from .hash    import HashIntegrity, format_file_stat, parse_file_stat
+
+CATALOG_BATCH_SIZE = 1000
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS integrity (
+    hash_name TEXT    NOT NULL,
+    directory TEXT    NOT NULL,
+    file_name TEXT    NOT NULL,
+    digest    TEXT    NOT NULL,
+    stat      TEXT,
+    result    INTEGER,
+    checked   REAL,
+    PRIMARY KEY (hash_name, directory, file_name)
+);
+CREATE INDEX IF NOT EXISTS integrity_result ON integrity (hash_name, result);
+"""
+
+class Catalog:
+    # NOTE: a single SQLite database holding hashes of the whole tree.
+    #       Writes are grouped into transactions of `batch_size` operations.
+
+    def __init__(self, path, batch_size = CATALOG_BATCH_SIZE):
+        self._path       = path
+        self._batch_size = batch_size
+        self._n_pending  = 0
+        self._lock       = threading.Lock()
+        self._conn       = sqlite3.connect(path, check_same_thread = False)
+
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.executescript(CATALOG_SCHEMA)
+        self._conn.commit()
+
+    @property
+    def path(self):
+        return self._path
+
+    def _add_pending(self, n = 1):
+        self._n_pending += n
+
+        if self._n_pending >= self._batch_size:
+            self._conn.commit()
+            self._n_pending = 0
+
+    def load(self, hash_name, directory):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT file_name, digest, stat FROM integrity"
+                " WHERE hash_name = ? AND directory = ?",
+                (hash_name, directory)
+            )
+
+            return cursor.fetchall()
+
+    def save(self, hash_name, directory, entries, removed):
+        # NOTE: `entries` are (file_name, digest, stat) tuples of changed
+        #       files, and `removed` are names of deleted ones. Last
+        #       verification results are kept for files whose digest did not
+        #       change.
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM integrity"
+                " WHERE hash_name = ? AND directory = ? AND file_name = ?",
+                [ (hash_name, directory, x) for x in removed ]
+            )
+
+            self._conn.executemany(
+                "INSERT INTO integrity"
+                " (hash_name, directory, file_name, digest, stat)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (hash_name, directory, file_name) DO UPDATE"
+                " SET result = CASE WHEN digest = excluded.digest"
+                "   THEN result ELSE NULL END,"
+                " digest = excluded.digest, stat = excluded.stat",
+                [ (hash_name, directory, *x) for x in entries ]
+            )
+
+            self._add_pending(len(removed) + len(entries))
+
+    def set_result(self, hash_name, directory, file_name, result):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE integrity SET result = ?, checked = ?"
+                " WHERE hash_name = ? AND directory = ? AND file_name = ?",
+                (result, time.time(), hash_name, directory, file_name)
+            )
+
+            self._add_pending()
+
+    def get_directories(self, hash_name, root_dir):
+        prefix = root_dir.rstrip(os.sep) + os.sep
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT DISTINCT directory FROM integrity"
+                " WHERE hash_name = ?"
+                " AND (directory = ? OR substr(directory, 1, ?) = ?)"
+                " ORDER BY directory",
+                (hash_name, root_dir, len(prefix), prefix)
+            )
+
+            return [ x[0] for x in cursor.fetchall() ]
+
+    def get_failures(self, hash_name, root_dir):
+        # NOTE: files under `root_dir` whose last verification failed
+        prefix = root_dir.rstrip(os.sep) + os.sep
+
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT directory, file_name, result FROM integrity"
+                " WHERE hash_name = ? AND result < ?"
+                " AND (directory = ? OR substr(directory, 1, ?) = ?)"
+                " ORDER BY directory, file_name",
+                (hash_name, RESULT_OK, root_dir, len(prefix), prefix)
+            )
+
+            return [
+                (os.path.join(d, f), r) for (d, f, r) in cursor.fetchall()
+            ]
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+            self._n_pending = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+class CatalogHashIntegrity(HashIntegrity):
+    # NOTE: hash integrity that keeps hashes and last results in a `Catalog`
+    #       instead of per-directory storage files
+
+    def __init__(self, catalog = None, **kwargs):
+        if catalog is None:
+            raise ValueError("Catalog must be specified")
+
+        super().__init__(**kwargs)
+        self._catalog = catalog
+
+    @property
+    def catalog(self):
+        return self._catalog
+
+    def _load(self):
+        self._reset_changes()
+
+        for (file_name, digest, stat) in self._catalog.load(
+            self._hash_name, self._root
+        ):
+            self._integrity_dict[file_name] = digest
+
+            if stat is not None:
+                self._stat_dict[file_name] = parse_file_stat(stat)
+
+    def _save(self):
+        # NOTE: only files changed or removed since loading are written
+        changed, removed = self._pop_changes()
+        entries          = []
+
+        if (not changed) and (not removed):
+            return
+
+        for file_name in changed:
+            file_stat = self._stat_dict.get(file_name, None)
+
+            if file_stat is not None:
+                file_stat = format_file_stat(file_stat)
+
+            entries.append(
+                (file_name, self._integrity_dict[file_name], file_stat)
+            )
+
+        self._catalog.save(self._hash_name, self._root, entries, removed)
+
+    def record_result(self, file_name, result):
+        self._catalog.set_result(
+            self._hash_name, self._root, file_name, result
+        )
+
+        return result
+
+    def verify(self, file_name, entry = None):
+        try:
+            result = super().verify(file_name, entry)
+        except OSError:
+            self.record_result(file_name, RESULT_ERROR)
+            raise
+
+        return self.record_result(file_name, result)
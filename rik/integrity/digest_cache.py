@@ -0,0 +1,55 @@
+import collections
+import threading
+
+DIGEST_CACHE_SIZE = 65536
+
+def get_cache_key(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class DigestCache:
+    # NOTE: LRU cache of file digests keyed on the physical file, so that
+    #       hard links to the same inode are read only once per run
+
+    def __init__(self, max_size = DIGEST_CACHE_SIZE):
+        if max_size <= 0:
+            raise ValueError(f"Cache size must be positive: '{max_size}'")
+
+        self._max_size = max_size
+        self._cache    = collections.OrderedDict()
+        self._lock     = threading.Lock()
+        self._hits     = 0
+        self._misses   = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key, hash_names):
+        with self._lock:
+            digests = self._cache.get(key, None)
+
+            if (digests is None) or any(x not in digests for x in hash_names):
+                self._misses += 1
+                return None
+
+            self._cache.move_to_end(key)
+            self._hits += 1
+
+            return [ digests[x] for x in hash_names ]
+
+    def put(self, key, hash_names, digests):
+        with self._lock:
+            entry = self._cache.setdefault(key, {})
+            entry.update(zip(hash_names, digests))
+
+            self._cache.move_to_end(key)
+
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last = False)
@@ -1,22 +1,59 @@
-import hashlib
+import collections
 import os
 
 from ..consts   import RESULT_OK, RESULT_MISMATCH, RESULT_ERROR
-from .integrity import Integrity
+from .digest_cache import get_cache_key
+from .hashers      import AVAILABLE_HASHES, KNOWN_HASHES, new_hasher
+from .integrity    import Integrity
+from .reader       import FileReader
+from .storage      import (
+    STORAGE_LOG_SUFFIX, get_storage_names, write_atomic, append_lines,
+    remove_file, read_lines, find_line
+)
 
-SUPPORTED_HASHES = [
-    'md5', 'sha1', 'sha256', 'sha512'
-]
+SUPPORTED_HASHES = AVAILABLE_HASHES
 
 HASH_STORAGE_PREFIX = '.rik_'
 HASH_STORAGE_NAMES  = [
-    HASH_STORAGE_PREFIX + x for x in SUPPORTED_HASHES
+    y for x in KNOWN_HASHES for y in get_storage_names(HASH_STORAGE_PREFIX + x)
 ]
 
-HASH_CHUNK_SIZE = 4096
+HASH_CHUNK_SIZE = None
 HASH_SEPARATOR  = '  '
+STAT_SEPARATOR  = ':'
 ENCODING = 'utf-8'
 
+# Digest of log records that remove an entry
+HASH_TOMBSTONE = '-'
+
+# Changes to storages with fewer entries are saved by rewriting them. Larger
+# storages get changes appended to a log, which is merged back (compacted)
+# once it holds more records than the given fraction of entries.
+HASH_LOG_MIN_ENTRIES = 1024
+HASH_LOG_MAX_RATIO   = 0.25
+
+FileStat = collections.namedtuple(
+    'FileStat', [ 'size', 'mtime_ns', 'ctime_ns', 'ino' ]
+)
+
+def get_file_stat(file_path, entry = None):
+    # NOTE: reuse the stat result cached by the walker, if available
+    stat = entry.stat() if (entry is not None) else os.stat(file_path)
+    return FileStat(
+        stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino
+    )
+
+def format_file_stat(file_stat):
+    return STAT_SEPARATOR.join(str(x) for x in file_stat)
+
+def parse_file_stat(spec):
+    tokens = spec.split(STAT_SEPARATOR)
+
+    if len(tokens) != len(FileStat._fields):
+        raise RuntimeError(f"Failed to parse file metadata: '{spec}'")
+
+    return FileStat(*(int(x) for x in tokens))
+
 def escape_path(path):
     if path.find('\n') > 0:
         path = path.replace('\n', '\\n')
@@ -24,13 +61,74 @@ def escape_path(path):
     else:
         return f'"{path}"'
 
+def is_escaped_path(path):
+    return path.startswith('"') or path.startswith('\\"')
+
 def unescape_path(path):
     if path.startswith('\\"'):
         return path[2:-1].replace('\\n', '\n')
 
     return path[1:-1]
 
+def parse_hash_line(line):
+    tokens = line.split(HASH_SEPARATOR, 1)
+
+    if len(tokens) != 2:
+        raise RuntimeError(f"Failed to parse hash string: '{line}'")
+
+    digest    = tokens[0]
+    file_stat = None
+
+    # NOTE: optional metadata goes between digest and file name
+    if not is_escaped_path(tokens[1]):
+        tokens = tokens[1].split(HASH_SEPARATOR, 1)
+
+        if len(tokens) != 2:
+            raise RuntimeError(f"Failed to parse hash string: '{line}'")
+
+        file_stat = parse_file_stat(tokens[0])
+
+    return (unescape_path(tokens[1]), digest, file_stat)
+
+def format_hash_line(file_name, digest, file_stat = None):
+    fname = escape_path(file_name)
+
+    if file_stat is None:
+        return f"{digest}{HASH_SEPARATOR}{fname}"
+
+    fstat = format_file_stat(file_stat)
+    return f"{digest}{HASH_SEPARATOR}{fstat}{HASH_SEPARATOR}{fname}"
+
+def get_line_name(line):
+    return parse_hash_line(line)[0]
+
+def calc_digests(file_path, hash_names, reader, cache = None, entry = None):
+    key = None
+
+    # NOTE: only files with several hard links can be met again, so there is
+    #       no point in caching digests of the others
+    if cache is not None:
+        stat = entry.stat() if (entry is not None) else os.stat(file_path)
+
+        if stat.st_nlink > 1:
+            key     = get_cache_key(stat)
+            digests = cache.get(key, hash_names)
+
+            if digests is not None:
+                return digests
+
+    hashers = [ new_hasher(x) for x in hash_names ]
+    reader.digest(file_path, hashers)
+
+    digests = [ m.hexdigest() for m in hashers ]
+
+    if key is not None:
+        cache.put(key, hash_names, digests)
+
+    return digests
+
 class HashIntegrity(Integrity):
+    # pylint: disable=too-many-instance-attributes
 
     def __init__(
         self,
@@ -39,10 +137,22 @@ class HashIntegrity(Integrity):
         recalc     = False,
         verbose    = False,
         chunk_size = HASH_CHUNK_SIZE,
+        metadata   = False,
+        quick      = False,
+        reader     = None,
+        cache      = None,
     ):
         # pylint: disable=too-many-arguments
         self._hash_name  = hash_name.lower()
-        self._chunk_size = chunk_size
+        self._reader     = reader or FileReader(chunk_size)
+        self._cache      = cache
+        self._metadata   = metadata
+        self._quick      = quick
+        self._stat_dict  = {}
+        self._changed    = set()
+        self._removed    = set()
+        self._n_log      = 0
+        self._partial    = False
 
         if self._hash_name not in SUPPORTED_HASHES:
             raise ValueError(f"Unknown hash: '{self._hash_name}'")
@@ -51,48 +161,129 @@ class HashIntegrity(Integrity):
             HASH_STORAGE_PREFIX + self._hash_name, writable, recalc, verbose
         )
 
+    @property
+    def log_path(self):
+        return self._storage_path + STORAGE_LOG_SUFFIX
+
+    def _add_line(self, line):
+        file_name, digest, file_stat = parse_hash_line(line)
+
+        if digest == HASH_TOMBSTONE:
+            self._integrity_dict.pop(file_name, None)
+            self._stat_dict.pop(file_name, None)
+            return
+
+        self._integrity_dict[file_name] = digest
+
+        if file_stat is not None:
+            self._stat_dict[file_name] = file_stat
+        else:
+            self._stat_dict.pop(file_name, None)
+
+    def _load_entries(self, file_names):
+        # NOTE: looks the entries up in the sorted storage file, instead of
+        #       parsing all of it. Later log records override earlier ones.
+        log_lines = {}
+
+        if os.path.isfile(self.log_path):
+            for line in read_lines(self.log_path, skip_incomplete = True):
+                file_name = get_line_name(line)
+                self._n_log += 1
+
+                if file_name in file_names:
+                    log_lines[file_name] = line
+
+        for file_name in file_names:
+            line = log_lines.get(file_name, None)
+
+            if (line is None) and os.path.isfile(self._storage_path):
+                line = find_line(self._storage_path, file_name, get_line_name)
+
+            if line is not None:
+                self._add_line(line)
+
+    def _reset_changes(self):
+        # NOTE: per-directory state, which shallow clones must not share
+        self._stat_dict = {}
+        self._changed   = set()
+        self._removed   = set()
+        self._n_log     = 0
+        self._partial   = False
+
     def _load(self):
-        if not os.path.isfile(self._storage_path):
+        self._reset_changes()
+        self._partial = (self._load_names is not None)
+
+        if self._partial:
+            self._load_entries(set(self._load_names))
             return
 
-        with open(self._storage_path, 'rt', encoding = ENCODING) as f:
-            for line in f.readlines():
-                line   = line.rstrip('\n')
-                tokens = line.split('  ', 1)
+        if os.path.isfile(self._storage_path):
+            for line in read_lines(self._storage_path):
+                self._add_line(line)
 
-                if len(tokens) != 2:
-                    raise RuntimeError(
-                        f"Failed to parse hash string: '{line}'"
-                    )
+        if os.path.isfile(self.log_path):
+            for line in read_lines(self.log_path, skip_incomplete = True):
+                self._add_line(line)
+                self._n_log += 1
 
-                digest    = tokens[0]
-                file_name = unescape_path(tokens[1])
+    @property
+    def hash_name(self):
+        return self._hash_name
 
-                self._integrity_dict[file_name] = digest
+    def get_digest(self, file_name):
+        return self._integrity_dict[file_name]
 
-    @staticmethod
-    def _calc_hash(file_path, hash_name, chunk_size):
-        m = hashlib.new(hash_name)
+    def get_stored_stat(self, file_name):
+        return self._stat_dict.get(file_name, None)
 
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda f=f,s=chunk_size : f.read(s), b''):
-                m.update(chunk)
+    def set_digest(self, file_name, digest, file_stat = None):
+        self._integrity_dict[file_name] = digest
+        self._changed.add(file_name)
+        self._removed.discard(file_name)
 
-        return m.hexdigest()
+        if file_stat is not None:
+            self._stat_dict[file_name] = file_stat
+        else:
+            self._stat_dict.pop(file_name, None)
 
-    def _calculate(self, file_name):
-        file_path = self._get_file_path(file_name)
-        digest    = HashIntegrity._calc_hash(
-            file_path, self._hash_name, self._chunk_size
+    def is_unchanged(self, file_name, entry = None):
+        file_stat = self._stat_dict.get(file_name, None)
+
+        if file_stat is None:
+            return False
+
+        return file_stat == get_file_stat(
+            self._get_file_path(file_name), entry
         )
 
+    def _calc_hash(self, file_path, entry):
+        return calc_digests(
+            file_path, [ self._hash_name, ], self._reader, self._cache, entry
+        )[0]
+
+    def _calculate(self, file_name, entry):
+        file_path = self._get_file_path(file_name)
+
+        # NOTE: metadata is taken before hashing, so that modifications made
+        #       while the file is being hashed are noticed next time
+        if self._metadata:
+            self._stat_dict[file_name] = get_file_stat(file_path, entry)
+        else:
+            self._stat_dict.pop(file_name, None)
+
+        digest = self._calc_hash(file_path, entry)
+        self._changed.add(file_name)
+        self._removed.discard(file_name)
+
         return RESULT_OK, digest
 
-    def _verify(self, file_name):
+    def _verify(self, file_name, entry):
+        if self._quick and self.is_unchanged(file_name, entry):
+            return RESULT_OK
+
         file_path = self._get_file_path(file_name)
-        digest    = HashIntegrity._calc_hash(
-            file_path, self._hash_name, self._chunk_size
-        )
+        digest    = self._calc_hash(file_path, entry)
 
         # pylint: disable=no-else-return
         if digest == self._integrity_dict[file_name]:
@@ -103,23 +294,73 @@ class HashIntegrity(Integrity):
     def _delete(self, file_name):
         # pylint: disable=no-else-return
         if file_name in self._integrity_dict:
+            self._removed.add(file_name)
+            self._changed.discard(file_name)
             return RESULT_OK
         else:
             return RESULT_ERROR
 
+    def _format_line(self, file_name):
+        return format_hash_line(
+            file_name,
+            self._integrity_dict[file_name],
+            self._stat_dict.get(file_name, None)
+        )
+
+    def _compact(self):
+        files = sorted(self._integrity_dict.keys())
+
+        write_atomic(
+            self._storage_path, (self._format_line(x) for x in files)
+        )
+        remove_file(self.log_path)
+
+        self._n_log = 0
+
+    def _needs_compaction(self, n_log):
+        n_entries = len(self._integrity_dict)
+
+        if not os.path.isfile(self._storage_path):
+            return True
+
+        if n_entries < HASH_LOG_MIN_ENTRIES:
+            return (n_log > 0)
+
+        return (n_log > HASH_LOG_MAX_RATIO * n_entries)
+
+    def _pop_changes(self):
+        # NOTE: returns sorted names of files changed and removed since the
+        #       last save
+        changed = sorted(
+            x for x in self._changed if x in self._integrity_dict
+        )
+        removed = sorted(self._removed.difference(changed))
+
+        self._changed = set()
+        self._removed = set()
+
+        return (changed, removed)
+
     def _save(self):
-        files = list(self._integrity_dict.keys())
-        files.sort()
+        changed, removed = self._pop_changes()
 
-        if not files:
-            if os.path.isfile(self._storage_path):
-                os.remove(self._storage_path)
-            return
+        lines  = [ self._format_line(x) for x in changed ]
+        lines += [ format_hash_line(x, HASH_TOMBSTONE) for x in removed ]
 
-        with open(self._storage_path, 'wt', encoding = ENCODING) as f:
-            for file_name in files:
-                digest = self._integrity_dict[file_name]
-                fname  = escape_path(file_name)
+        # NOTE: only some entries are known, so the storage cannot be
+        #       rewritten
+        if self._partial:
+            if lines:
+                append_lines(self.log_path, lines)
+            return
 
-                f.write(f"{digest}{HASH_SEPARATOR}{fname}\n")
+        if not self._integrity_dict:
+            remove_file(self._storage_path)
+            remove_file(self.log_path)
+            return
 
+        if self._needs_compaction(self._n_log + len(lines)):
+            self._compact()
+        elif lines:
+            append_lines(self.log_path, lines)
+            self._n_log += len(lines)
@@ -0,0 +1,60 @@
+import hashlib
+
+# NOTE: fast non-cryptographic and cryptographic hashes from third-party
+#       modules are used only when they are installed
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+BUILTIN_HASHES = [
+    'md5', 'sha1', 'sha256', 'sha512', 'blake2b', 'blake2s'
+]
+
+# Names match the command line tools (xxh128sum, b3sum) producing the same
+# digests
+OPTIONAL_HASHES = {
+    'xxh128' : xxhash.xxh3_128 if (xxhash is not None) else None,
+    'blake3' : blake3.blake3   if (blake3 is not None) else None,
+}
+
+# All hashes rik knows about, whether available or not. Used to recognize
+# integrity files made on other machines.
+KNOWN_HASHES = BUILTIN_HASHES + list(OPTIONAL_HASHES.keys())
+
+AVAILABLE_HASHES = BUILTIN_HASHES + [
+    k for (k, v) in OPTIONAL_HASHES.items() if v is not None
+]
+
+def new_hasher(hash_name, data = None):
+    constructor = OPTIONAL_HASHES.get(hash_name, None)
+
+    if hash_name in OPTIONAL_HASHES:
+        if constructor is None:
+            raise ValueError(
+                f"Hash '{hash_name}' requires a module that is not installed"
+            )
+
+        result = constructor()
+    else:
+        result = hashlib.new(hash_name)
+
+    if data is not None:
+        result.update(data)
+
+    return result
+
+class HasherGroup:
+    # NOTE: passes data to several hashers, so that they can be fed as one
+
+    def __init__(self, hashers):
+        self._hashers = hashers
+
+    def update(self, data):
+        for m in self._hashers:
+            m.update(data)
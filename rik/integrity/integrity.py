@@ -1,3 +1,4 @@
+import copy
 import os
 
 from ..consts import RESULT_OK, RESULT_SKIP, RESULT_NEW, RESULT_ERROR
@@ -15,11 +16,16 @@ class Integrity:
         self._verbose        = verbose
         self._files_seen     = set()
         self._integrity_dict = {}
+        self._load_names     = None
 
     @property
     def storage_path(self):
         return self._storage_path
 
+    @property
+    def can_repair(self):
+        return False
+
     @property
     def known_files(self):
         return list(self._integrity_dict.keys())
@@ -28,6 +34,9 @@ class Integrity:
     def seen_files(self):
         return self._files_seen
 
+    def has_integrity(self, file_name):
+        return file_name in self._integrity_dict
+
     def _get_file_path(self, file_name):
         return os.path.join(self._root, file_name)
 
@@ -37,19 +46,30 @@ class Integrity:
     def _save(self):
         raise RuntimeError("Not Implemented")
 
-    def _calculate(self, file_name):
+    def _calculate(self, file_name, entry):
         raise RuntimeError("Not Implemented")
 
-    def _verify(self, file_name):
+    def _verify(self, file_name, entry):
         raise RuntimeError("Not Implemented")
 
     def _delete(self, file_name):
         raise RuntimeError("Not Implemented")
 
-    def load(self, root):
+    def _repair(self, file_name):
+        raise RuntimeError("Not Implemented")
+
+    def clone(self):
+        # NOTE: per-directory state is reset by `load`, so a shallow copy is
+        #       enough to process several directories concurrently
+        return copy.copy(self)
+
+    def load(self, root, file_names = None):
+        # NOTE: if `file_names` are given, only their entries are needed.
+        #       Integrities may still load all the others.
         self._root           = root
         self._files_seen     = set()
         self._integrity_dict = {}
+        self._load_names     = file_names
         self._storage_path   = os.path.join(self._root, self._storage_name)
         self._load()
 
@@ -60,30 +80,55 @@ class Integrity:
         self._save()
         return RESULT_OK
 
-    def calculate(self, file_name):
+    def calculate(self, file_name, entry = None):
         self._files_seen.add(file_name)
 
         if (file_name in self._integrity_dict) and (not self._recalc):
             return RESULT_SKIP
 
         # pylint: disable=assignment-from-no-return
-        result, file_integrity = self._calculate(file_name)
+        result, file_integrity = self._calculate(file_name, entry)
 
         if result == RESULT_OK:
             self._integrity_dict[file_name] = file_integrity
 
         return result
 
-    def verify(self, file_name):
+    def verify(self, file_name, entry = None):
         self._files_seen.add(file_name)
 
         if file_name not in self._integrity_dict:
             return RESULT_NEW
 
-        return self._verify(file_name)
+        return self._verify(file_name, entry)
+
+    def reverify(self, file_name, details = None, entry = None):
+        # NOTE: verifies a file again, e.g. after its repair. `details` are
+        #       the ones reported by the earlier verification of the file.
+        # pylint: disable=unused-argument
+        return self.verify(file_name, entry)
+
+    def flush(self):
+        # NOTE: finishes calculations deferred by `calculate` and returns
+        #       their (file_name, result) pairs
+        return []
+
+    def get_details(self, file_name):
+        # NOTE: extra information about the last result for `file_name`
+        # pylint: disable=unused-argument
+        return None
+
+    def record_result(self, file_name, result):
+        # pylint: disable=unused-argument
+        return result
 
     def repair(self, file_name):
-        raise RuntimeError("Not Implemented")
+        self._files_seen.add(file_name)
+
+        if file_name not in self._integrity_dict:
+            return RESULT_NEW
+
+        return self._repair(file_name)
 
     def mark_as_seen(self, file_name):
         self._files_seen.add(file_name)
@@ -0,0 +1,195 @@
+from ..consts import (
+    RESULT_OK, RESULT_SKIP, RESULT_NEW, RESULT_MISMATCH, RESULT_ERROR
+)
+from .hash import (
+    HashIntegrity, HASH_CHUNK_SIZE, calc_digests, get_file_stat
+)
+from .catalog   import CatalogHashIntegrity
+from .integrity import Integrity
+from .reader    import FileReader
+
+HASH_NAME_SEPARATOR = ','
+
+def parse_hash_names(spec):
+    return [ x.strip().lower() for x in spec.split(HASH_NAME_SEPARATOR) ]
+
+class MultiHashIntegrity(Integrity):
+    # NOTE: maintains several hash storages at once, reading each file only
+    #       once and feeding its content to all the hashes
+
+    def __init__(
+        self,
+        hash_names = None,
+        writable   = False,
+        recalc     = False,
+        verbose    = False,
+        chunk_size = HASH_CHUNK_SIZE,
+        metadata   = False,
+        quick      = False,
+        reader     = None,
+        catalog    = None,
+        cache      = None,
+    ):
+        # pylint: disable=too-many-arguments
+        super().__init__(None, writable, recalc, verbose)
+
+        if not hash_names:
+            raise ValueError("At least one hash must be specified")
+
+        if len(set(hash_names)) != len(hash_names):
+            raise ValueError(f"Duplicate hashes: '{hash_names}'")
+
+        self._reader     = reader or FileReader(chunk_size)
+        self._metadata   = metadata
+        self._quick      = quick
+        self._cache      = cache
+
+        kwargs = {
+            'writable' : writable,
+            'recalc'   : recalc,
+            'verbose'  : verbose,
+            'metadata' : metadata,
+            'quick'    : quick,
+            'reader'   : self._reader,
+            'cache'    : cache,
+        }
+
+        if catalog is not None:
+            self._integrities = [
+                CatalogHashIntegrity(
+                    catalog = catalog, hash_name = x, **kwargs
+                )
+                for x in hash_names
+            ]
+        else:
+            self._integrities = [
+                HashIntegrity(hash_name = x, **kwargs) for x in hash_names
+            ]
+
+    @property
+    def known_files(self):
+        result = set()
+
+        for integrity in self._integrities:
+            result.update(integrity.known_files)
+
+        return list(result)
+
+    @property
+    def seen_files(self):
+        result = set()
+
+        for integrity in self._integrities:
+            result.update(integrity.seen_files)
+
+        return result
+
+    def has_integrity(self, file_name):
+        return any(x.has_integrity(file_name) for x in self._integrities)
+
+    def clone(self):
+        # pylint: disable=protected-access
+        result = super().clone()
+        result._integrities = [ x.clone() for x in self._integrities ]
+
+        return result
+
+    def load(self, root, file_names = None):
+        self._root = root
+
+        for integrity in self._integrities:
+            integrity.load(root, file_names)
+
+    def save(self):
+        result = RESULT_OK
+
+        for integrity in self._integrities:
+            if integrity.save() != RESULT_OK:
+                result = RESULT_ERROR
+
+        return result
+
+    def mark_as_seen(self, file_name):
+        for integrity in self._integrities:
+            integrity.mark_as_seen(file_name)
+
+    def _calc_digests(self, file_name, integrities, entry):
+        return calc_digests(
+            self._get_file_path(file_name),
+            [ x.hash_name for x in integrities ],
+            self._reader,
+            self._cache,
+            entry
+        )
+
+    def calculate(self, file_name, entry = None):
+        self.mark_as_seen(file_name)
+
+        integrities = [
+            x for x in self._integrities
+                if self._recalc or (not x.has_integrity(file_name))
+        ]
+
+        if not integrities:
+            return RESULT_SKIP
+
+        file_stat = None
+
+        if self._metadata:
+            file_stat = get_file_stat(self._get_file_path(file_name), entry)
+
+        digests = self._calc_digests(file_name, integrities, entry)
+
+        for (integrity, digest) in zip(integrities, digests):
+            integrity.set_digest(file_name, digest, file_stat)
+
+        return RESULT_OK
+
+    def verify(self, file_name, entry = None):
+        self.mark_as_seen(file_name)
+
+        integrities = [
+            x for x in self._integrities if x.has_integrity(file_name)
+        ]
+
+        if not integrities:
+            return RESULT_NEW
+
+        if self._quick and all(
+            x.is_unchanged(file_name, entry) for x in integrities
+        ):
+            return self._record_result(file_name, integrities, RESULT_OK)
+
+        try:
+            digests = self._calc_digests(file_name, integrities, entry)
+        except OSError:
+            self._record_result(file_name, integrities, RESULT_ERROR)
+            raise
+
+        result = RESULT_OK
+
+        for (integrity, digest) in zip(integrities, digests):
+            if digest == integrity.get_digest(file_name):
+                integrity.record_result(file_name, RESULT_OK)
+            else:
+                integrity.record_result(file_name, RESULT_MISMATCH)
+                result = RESULT_MISMATCH
+
+        return result
+
+    @staticmethod
+    def _record_result(file_name, integrities, result):
+        for integrity in integrities:
+            integrity.record_result(file_name, result)
+
+        return result
+
+    def prune(self):
+        # NOTE: dict keeps the order of pruned files and drops duplicates
+        result = {}
+
+        for integrity in self._integrities:
+            for file_path in integrity.prune():
+                result[file_path] = True
+
+        return list(result.keys())
@@ -1,108 +1,447 @@
+import collections
+import concurrent.futures
+import functools
 import os
 import re
 import shutil
 import subprocess
-
-from ..consts   import RESULT_OK, RESULT_ERROR, RESULT_NEW, RESULT_MISMATCH
-from .integrity import Integrity
+import sys
+import threading
+import uuid
+
+from ..consts import (
+    RESULT_OK, RESULT_ERROR, RESULT_NEW, RESULT_MISMATCH, RESULT_DEFER
+)
+from .hash           import escape_path, unescape_path, ENCODING
+from .integrity      import Integrity
+from .par2_profiles  import override_par2_args
+from .par2_scheduler import Par2Scheduler, strip_thread_args
 
 PAR2_CMDNAME      = 'par2'
 PAR2_STORAGE_NAME = '.par2'
 PAR2_RESULT_EXT   = 'par2'
 PAR2_DEFAULT_ARGS = [ '-s524288' ]
 
+# Small files may be grouped into shared recovery sets (batches). Each batch
+# has an index file listing the files it covers.
+PAR2_BATCH_PREFIX    = '.rik_batch_'
+PAR2_BATCH_INDEX_EXT = 'files'
+PAR2_BATCH_MAX_FILES = 256
+
+PAR2_VOLUME_REGEXP = re.compile(
+    r'^(.+)\.vol\d+\+\d+\.' + re.escape(PAR2_RESULT_EXT) + r'$'
+)
+PAR2_TARGET_REGEXP = re.compile(r'^Target: "(.*)" - (\w+)')
+PAR2_TARGET_FOUND  = 'found'
+
+# par2cmdline exit codes
+PAR2_EXIT_SUCCESS             = 0
+PAR2_EXIT_REPAIR_POSSIBLE     = 1
+PAR2_EXIT_REPAIR_NOT_POSSIBLE = 2
+
+PAR2_VERIFY_RESULT_MAP = {
+    PAR2_EXIT_SUCCESS             : RESULT_OK,
+    PAR2_EXIT_REPAIR_POSSIBLE     : RESULT_MISMATCH,
+    PAR2_EXIT_REPAIR_NOT_POSSIBLE : RESULT_MISMATCH,
+}
+
+PAR2_REPAIR_RESULT_MAP = {
+    PAR2_EXIT_SUCCESS             : RESULT_OK,
+    PAR2_EXIT_REPAIR_NOT_POSSIBLE : RESULT_MISMATCH,
+}
+
+@functools.lru_cache(maxsize = None)
+def find_par2():
+    # NOTE: the lookup is done once per process, so that integrities can be
+    #       created cheaply and often. A failed one raises and is not cached.
+    result = shutil.which(PAR2_CMDNAME)
+
+    if result is None:
+        raise RuntimeError(
+            f"par2 application '{PAR2_CMDNAME}' is not found in system"
+            " $PATH. Make sure that par2 is installed"
+        )
+
+    return result
+
 class Par2Integrity(Integrity):
+    # pylint: disable=too-many-instance-attributes
 
     def __init__(
         self,
-        writable  = False,
-        recalc    = False,
-        verbose   = True,
-        par2_args = None,
+        writable   = False,
+        recalc     = False,
+        verbose    = True,
+        par2_args  = None,
+        jobs       = 1,
+        batch_size = 0,
+        throttle   = None,
+        stats      = None,
+        profiles   = None,
     ):
+        # pylint: disable=too-many-arguments
         super().__init__(PAR2_STORAGE_NAME, writable, recalc, verbose)
 
+        # NOTE: with `profiles`, the creation arguments are picked by file
+        #       size, and `par2_args` override them
+        self._profiles      = profiles
+
+        # NOTE: files smaller than `batch_size` are put into shared batches
+        self._batch_size    = batch_size
+        self._batches       = {}
+        self._file_batch    = {}
+        self._batch_results = {}
+        self._batch_repairs = {}
+        self._pending       = []
+        self._archives      = {}
+
+        # NOTE: reentrant, since unlinking a batch under the lock may remove
+        #       its recovery set
+        self._batch_lock    = threading.RLock()
+
         if par2_args is None:
             par2_args = PAR2_DEFAULT_ARGS
 
-        self._par2_args = par2_args
+        # NOTE: the scheduler is shared by all clones of this integrity
+        self._scheduler   = Par2Scheduler(
+            max_procs = jobs, throttle = throttle, stats = stats
+        )
+        self._user_args   = list(par2_args)
+        self._par2_args   = strip_thread_args(par2_args)
+        self._thread_args = self._scheduler.get_thread_args(par2_args)
         self.verify_par2_exists()
 
     def verify_par2_exists(self):
-        result = shutil.which(PAR2_CMDNAME)
-        if result is None:
-            raise RuntimeError(
-                f"par2 application '{PAR2_CMDNAME}' is not found in system"
-                " $PATH. Make sure that par2 is installed"
-            )
+        find_par2()
+
+    def _get_create_args(self, size):
+        if self._profiles is None:
+            return [ *self._par2_args, *self._thread_args ]
+
+        par2_args = override_par2_args(
+            self._profiles.select(size), self._user_args
+        )
+
+        return [
+            *strip_thread_args(par2_args),
+            *self._scheduler.get_thread_args(par2_args)
+        ]
 
     def _get_par2_archive_name(self, file_name):
         return os.path.join(
             self._storage_path, f"{file_name}.{PAR2_RESULT_EXT}"
         )
 
+    def _get_batch_index_name(self, batch_name):
+        return os.path.join(
+            self._storage_path, f"{batch_name}.{PAR2_BATCH_INDEX_EXT}"
+        )
+
+    def _load_batch(self, batch_name):
+        index_path = self._get_batch_index_name(batch_name)
+        files      = []
+
+        with open(index_path, 'rt', encoding = ENCODING) as f:
+            for line in f:
+                files.append(unescape_path(line.rstrip('\n')))
+
+        self._batches[batch_name] = files
+        archive_path = self._get_par2_archive_name(batch_name)
+
+        for file_name in files:
+            self._file_batch[file_name]     = batch_name
+            self._integrity_dict[file_name] = archive_path
+
+    def _save_batch(self, batch_name):
+        index_path = self._get_batch_index_name(batch_name)
+        files      = self._batches[batch_name]
+
+        with open(index_path, 'wt', encoding = ENCODING) as f:
+            for file_name in files:
+                f.write(escape_path(file_name) + '\n')
+
+    def _list_data_files(self):
+        # NOTE: the directory is listed once, instead of checking whether
+        #       a file exists for every volume
+        try:
+            with os.scandir(self._root) as it:
+                return set(x.name for x in it if x.is_file())
+        except OSError:
+            return set()
+
+    def _scan_storage(self):
+        # NOTE: indexes the storage in a single pass. Maps the name of each
+        #       recovery set (protected file or batch) to the names of its
+        #       archive and volume files.
+        ext       = '.' + PAR2_RESULT_EXT
+        index_ext = '.' + PAR2_BATCH_INDEX_EXT
+        names     = []
+        batches   = []
+        archives  = collections.defaultdict(list)
+
+        with os.scandir(self._storage_path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+
+                name = entry.name
+
+                if name.endswith(ext):
+                    names.append(name)
+                elif (
+                    name.startswith(PAR2_BATCH_PREFIX)
+                    and name.endswith(index_ext)
+                ):
+                    batches.append(name[:len(name) - len(index_ext)])
+
+        name_set   = set(names)
+        bases      = set()
+        data_names = None
+
+        for name in names:
+            match = PAR2_VOLUME_REGEXP.match(name)
+
+            if match:
+                bases.add(match.group(1))
+
+        for name in names:
+            match = PAR2_VOLUME_REGEXP.match(name)
+            base  = name[:len(name) - len(ext)]
+
+            # NOTE: a volume belongs to the set whose main archive exists.
+            #       Otherwise the name is taken as a main archive itself, so
+            #       that orphaned volumes get pruned. A name that looks like
+            #       a volume is still a main archive if it has volumes of its
+            #       own or the file it would protect exists.
+            is_volume = (
+                match and ((match.group(1) + ext) in name_set)
+                and (base not in bases)
+            )
+
+            if is_volume:
+                if data_names is None:
+                    data_names = self._list_data_files()
+
+                is_volume = (base not in data_names)
+
+            if is_volume:
+                archives[match.group(1)].append(name)
+            else:
+                archives[base].append(name)
+
+        return (dict(archives), batches)
+
     def _load(self):
+        self._batches       = {}
+        self._file_batch    = {}
+        self._batch_results = {}
+        self._batch_repairs = {}
+        self._batch_lock    = threading.RLock()
+        self._pending       = []
+        self._archives      = {}
+
         if not os.path.isdir(self._storage_path):
             return
 
-        archive_part_regexp = re.compile(
-            r'^.+\.vol\d+\+\d+\.' + re.escape(PAR2_RESULT_EXT) + r'$'
-        )
+        self._archives, batches = self._scan_storage()
 
-        ext = '.' + PAR2_RESULT_EXT
+        for batch_name in batches:
+            self._load_batch(batch_name)
 
-        for name in os.listdir(self._storage_path):
-            path = os.path.join(self._storage_path, name)
+        for file_name in self._archives:
+            if file_name not in self._batches:
+                self._integrity_dict[file_name] = \
+                    self._get_par2_archive_name(file_name)
 
-            if not os.path.isfile(path):
-                continue
+    def _is_batched(self, file_name, entry):
+        if self._batch_size <= 0:
+            return False
 
-            if not name.endswith(ext):
-                continue
+        if entry is not None:
+            size = entry.stat().st_size
+        else:
+            size = os.path.getsize(self._get_file_path(file_name))
+
+        return size < self._batch_size
 
-            if archive_part_regexp.match(name):
-                continue
+    def _get_file_size(self, file_name, entry = None):
+        try:
+            if entry is not None:
+                return entry.stat().st_size
 
-            file_name = name[:len(name) - len(ext)]
-            self._integrity_dict[file_name] = path
+            return os.path.getsize(self._get_file_path(file_name))
+        except OSError:
+            return 0
 
-    def _calculate(self, file_name):
+    def _calculate(self, file_name, entry):
         if not self._writable:
             return RESULT_ERROR, None
 
-        if not os.path.isdir(self._storage_path):
-            try:
-                os.mkdir(self._storage_path)
-            except OSError:
-                return RESULT_ERROR, None
+        try:
+            os.makedirs(self._storage_path, exist_ok = True)
+        except OSError:
+            return RESULT_ERROR, None
+
+        # NOTE: batched files are processed together by `flush`
+        if self._is_batched(file_name, entry):
+            self._pending.append(file_name)
+            return RESULT_DEFER, None
 
         archive_path = self._get_par2_archive_name(file_name)
         file_path    = self._get_file_path(file_name)
 
+        # NOTE: par2 refuses to overwrite the recovery set of a file whose
+        #       integrity is recalculated
+        if (file_name in self._integrity_dict) and (
+            file_name not in self._file_batch
+        ):
+            self._remove_archive(file_name)
+
+        size      = self._get_file_size(file_name, entry)
         par2_args = [
             PAR2_CMDNAME, 'create',
             '-a', archive_path,
             '-B', self._root,
-            *self._par2_args,
+            *self._get_create_args(size),
             '--', file_path
         ]
 
         output = None if self._verbose else subprocess.DEVNULL
+        result = self._scheduler.run(par2_args, output, size)
 
-        # pylint: disable=(subprocess-run-check)
-        result = subprocess.run(
-            par2_args,
-            stdout = output,
-            shell  = False
+        if result.returncode != PAR2_EXIT_SUCCESS:
+            return (RESULT_ERROR, archive_path)
+
+        # NOTE: the file may have been batched before it grew
+        with self._batch_lock:
+            self._unlink_batch(file_name)
+
+        return (RESULT_OK, archive_path)
+
+    def _create_batch(self, files):
+        batch_name   = PAR2_BATCH_PREFIX + uuid.uuid4().hex[:16]
+        archive_path = self._get_par2_archive_name(batch_name)
+
+        # NOTE: a batch is protected as a whole, so its profile is picked
+        #       by its total size
+        size      = sum(self._get_file_size(x) for x in files)
+        par2_args = [
+            PAR2_CMDNAME, 'create',
+            '-a', archive_path,
+            '-B', self._root,
+            *self._get_create_args(size),
+            '--', *(self._get_file_path(x) for x in files)
+        ]
+
+        output = None if self._verbose else subprocess.DEVNULL
+        result = self._scheduler.run(par2_args, output, size)
+
+        if result.returncode != PAR2_EXIT_SUCCESS:
+            self._remove_archive(batch_name)
+            return RESULT_ERROR
+
+        for file_name in files:
+            if file_name in self._file_batch:
+                self._unlink_batch(file_name)
+            elif file_name in self._integrity_dict:
+                self._remove_archive(file_name)
+
+            self._file_batch[file_name]     = batch_name
+            self._integrity_dict[file_name] = archive_path
+
+        self._batches[batch_name] = list(files)
+
+        try:
+            self._save_batch(batch_name)
+        except OSError:
+            self._remove_batch(batch_name)
+            return RESULT_ERROR
+
+        return RESULT_OK
+
+    def flush(self):
+        pending       = self._pending
+        self._pending = []
+        results       = []
+
+        for idx in range(0, len(pending), PAR2_BATCH_MAX_FILES):
+            files  = pending[idx:idx + PAR2_BATCH_MAX_FILES]
+            result = self._create_batch(files)
+
+            results += [ (x, result) for x in files ]
+
+        return results
+
+    def _run_batch_verify(self, batch_name):
+        archive_path = self._get_par2_archive_name(batch_name)
+
+        par2_args = [
+            PAR2_CMDNAME, 'verify',
+            '-B', self._root,
+            *self._thread_args,
+            '--', archive_path
+        ]
+
+        result = self._scheduler.run(
+            par2_args, subprocess.PIPE,
+            sum(self._get_file_size(x) for x in self._batches[batch_name])
         )
+        output = os.fsdecode(result.stdout or b'')
 
-        # pylint: disable=no-else-return
-        if result.returncode == 0:
-            return (RESULT_OK, archive_path)
-        else:
-            return (RESULT_ERROR, archive_path)
+        if self._verbose:
+            sys.stdout.write(output)
+
+        default = PAR2_VERIFY_RESULT_MAP.get(result.returncode, RESULT_ERROR)
+        results = { x : default for x in self._batches[batch_name] }
+
+        # NOTE: par2 reports the state of each file of the set separately
+        for line in output.splitlines():
+            match = PAR2_TARGET_REGEXP.match(line.strip())
+
+            if match and (match.group(1) in results):
+                if match.group(2) == PAR2_TARGET_FOUND:
+                    results[match.group(1)] = RESULT_OK
+                else:
+                    results[match.group(1)] = RESULT_MISMATCH
+
+        return results
+
+    def _run_batch_once(self, cache, batch_name, fn, *args):
+        # NOTE: `fn` runs once per batch, and the other files of the batch
+        #       wait for its result. The lock is held only to look the run
+        #       up, so that different batches are processed in parallel.
+        with self._batch_lock:
+            future = cache.get(batch_name, None)
+            owner  = (future is None)
+
+            if owner:
+                future = concurrent.futures.Future()
+                cache[batch_name] = future
+
+        if owner:
+            # pylint: disable=broad-except
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        return future.result()
+
+    def _verify_batched(self, file_name):
+        batch_name = self._file_batch[file_name]
+
+        # NOTE: the whole batch is verified once for all of its files
+        results = self._run_batch_once(
+            self._batch_results, batch_name, self._run_batch_verify,
+            batch_name
+        )
+
+        return results[file_name]
+
+    def _verify(self, file_name, entry):
+        if file_name in self._file_batch:
+            return self._verify_batched(file_name)
 
-    def _verify(self, file_name):
         archive_path = self._get_par2_archive_name(file_name)
 
         if not os.path.isfile(archive_path):
@@ -111,54 +450,167 @@ class Par2Integrity(Integrity):
         par2_args = [
             PAR2_CMDNAME, 'verify',
             '-B', self._root,
+            *self._thread_args,
             '--', archive_path
         ]
 
         output = None if self._verbose else subprocess.DEVNULL
+        result = self._scheduler.run(
+            par2_args, output, self._get_file_size(file_name, entry)
+        )
+
+        return PAR2_VERIFY_RESULT_MAP.get(result.returncode, RESULT_ERROR)
 
-        # pylint: disable=(subprocess-run-check)
-        result = subprocess.run(
-            par2_args,
-            stdout = output,
-            shell  = False
+    @property
+    def can_repair(self):
+        return True
+
+    def _run_repair(self, archive_path, n_bytes):
+        # NOTE: par2cmdline keeps damaged files next to the repaired ones,
+        #       with a numeric suffix (e.g. `file.1`)
+        par2_args = [
+            PAR2_CMDNAME, 'repair',
+            '-B', self._root,
+            *self._thread_args,
+            '--', archive_path
+        ]
+
+        output = None if self._verbose else subprocess.DEVNULL
+        result = self._scheduler.run(par2_args, output, n_bytes)
+
+        return PAR2_REPAIR_RESULT_MAP.get(result.returncode, RESULT_ERROR)
+
+    def _repair_batched(self, file_name):
+        batch_name = self._file_batch[file_name]
+        files      = self._batches[batch_name]
+
+        # NOTE: the whole batch is repaired once for all of its files
+        return self._run_batch_once(
+            self._batch_repairs, batch_name, self._run_repair,
+            self._get_par2_archive_name(batch_name),
+            sum(self._get_file_size(x) for x in files)
         )
 
-        # pylint: disable=no-else-return
-        if result.returncode == 0:
+    def _repair(self, file_name):
+        if file_name in self._file_batch:
+            return self._repair_batched(file_name)
+
+        archive_path = self._get_par2_archive_name(file_name)
+
+        if not os.path.isfile(archive_path):
+            return RESULT_NEW
+
+        return self._run_repair(archive_path, self._get_file_size(file_name))
+
+    def _remove_batch(self, batch_name):
+        result = self._remove_archive(batch_name)
+
+        try:
+            os.remove(self._get_batch_index_name(batch_name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            result = RESULT_ERROR
+
+        for file_name in self._batches.pop(batch_name, []):
+            if self._file_batch.get(file_name, None) == batch_name:
+                self._file_batch.pop(file_name)
+
+        return result
+
+    def _unlink_batch_files(self, batch_name, file_names):
+        # NOTE: recovery sets cannot shrink. A batch keeps protecting its
+        #       remaining files and is removed once it covers no files.
+        files = self._batches[batch_name]
+
+        for file_name in file_names:
+            self._file_batch.pop(file_name, None)
+
+        removed  = set(file_names)
+        files[:] = [ x for x in files if x not in removed ]
+
+        if not files:
+            return self._remove_batch(batch_name)
+
+        try:
+            self._save_batch(batch_name)
+        except OSError:
+            return RESULT_ERROR
+
+        return RESULT_OK
+
+    def _unlink_batch(self, file_name):
+        batch_name = self._file_batch.get(file_name, None)
+
+        if batch_name is None:
             return RESULT_OK
-        else:
-            return RESULT_MISMATCH
+
+        return self._unlink_batch_files(batch_name, [ file_name ])
 
     def _delete(self, file_name):
 
         if not self._writable:
             return RESULT_ERROR
 
-        par2_archive_regexp = re.compile(
-            r'^(?:\.vol\d+\+\d+)?\.' + re.escape(PAR2_RESULT_EXT) + r'$'
-        )
+        if file_name in self._file_batch:
+            return self._unlink_batch(file_name)
 
-        result = RESULT_OK
+        return self._remove_archive(file_name)
 
-        for name in os.listdir(self._storage_path):
-            path = os.path.join(self._storage_path, name)
+    def _remove_archive(self, file_name):
+        if not os.path.isdir(self._storage_path):
+            return RESULT_OK
 
-            if not os.path.isfile(path):
-                continue
+        # NOTE: recovery sets may be removed by several worker threads
+        with self._batch_lock:
+            names = self._archives.pop(file_name, None)
 
-            if not name.startswith(file_name):
-                continue
+            # NOTE: recovery sets created after loading are not indexed yet
+            if names is None:
+                self._archives = self._scan_storage()[0]
+                names = self._archives.pop(file_name, [])
 
-            name_suffix = name[len(file_name):]
+        result = RESULT_OK
 
-            if par2_archive_regexp.match(name_suffix):
-                try:
-                    os.remove(path)
-                except OSError:
-                    result = RESULT_ERROR
+        for name in names:
+            try:
+                os.remove(os.path.join(self._storage_path, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                result = RESULT_ERROR
 
         return result
 
+    def prune(self):
+        # NOTE: removes all obsolete recovery sets in one pass. Files of a
+        #       batch are unlinked together, rewriting its index once.
+        if not self._writable:
+            return []
+
+        obsolete = [
+            x for x in self._integrity_dict if x not in self._files_seen
+        ]
+        pruned   = []
+        batches  = collections.defaultdict(list)
+
+        for file_name in obsolete:
+            batch_name = self._file_batch.get(file_name, None)
+
+            if batch_name is not None:
+                batches[batch_name].append(file_name)
+            elif self._remove_archive(file_name) == RESULT_OK:
+                pruned.append(file_name)
+
+        for (batch_name, files) in batches.items():
+            if self._unlink_batch_files(batch_name, files) == RESULT_OK:
+                pruned += files
+
+        for file_name in pruned:
+            self._integrity_dict.pop(file_name)
+
+        return [ os.path.join(self._root, x) for x in pruned ]
+
     def _save(self):
         if not self._integrity_dict:
             if os.path.isdir(self._storage_path):
@@ -0,0 +1,112 @@
+import shlex
+
+from ..path_constraints import parse_size
+
+PAR2_PROFILES_BUILTIN = 'builtin'
+PAR2_PROFILE_ANY_SIZE = '*'
+
+# (files smaller than, par2 arguments). Block sizes grow with file sizes, so
+# that small files do not get recovery blocks much larger than themselves.
+# Each fixed block size tier ends at 16384 blocks, half of the par2 limit
+# (32768). Larger files get a fixed block count instead, so their blocks
+# keep growing with them. Small files get more redundancy than the par2
+# default (5%), which costs little space for them. par2 memory is capped for
+# large files, since several par2 processes may run at once. Thread counts
+# are left to the scheduler.
+PAR2_BUILTIN_PROFILES = [
+    (64 * 1024,          [ '-s1024',    '-r20'   ]),
+    (1024 * 1024,        [ '-s8192',    '-r10'   ]),
+    (64 * 1024 * 1024,   [ '-s65536'             ]),
+    (4 * 1024 ** 3,      [ '-s524288'            ]),
+    (64 * 1024 ** 3,     [ '-s4194304', '-m1024' ]),
+    (None,               [ '-b16384',   '-m1024' ]),
+]
+
+# Options setting the same parameter. A later one replaces the earlier ones.
+PAR2_OPTION_ALIASES = {
+    '-b' : '-s',
+    '-c' : '-r',
+}
+
+def get_par2_option(arg):
+    if (not arg.startswith('-')) or (len(arg) < 2):
+        return None
+
+    return PAR2_OPTION_ALIASES.get(arg[:2], arg[:2])
+
+def override_par2_args(par2_args, overrides):
+    # NOTE: par2cmdline refuses some options given twice (e.g. a block size
+    #       and a block count), so the replaced ones are dropped
+    options = set(get_par2_option(x) for x in overrides)
+    options.discard(None)
+
+    return [
+        x for x in par2_args if get_par2_option(x) not in options
+    ] + list(overrides)
+
+def parse_profile_line(line):
+    tokens = shlex.split(line, comments = True)
+
+    if not tokens:
+        return None
+
+    if tokens[0] == PAR2_PROFILE_ANY_SIZE:
+        max_size = None
+    else:
+        max_size = parse_size(tokens[0])
+
+    return (max_size, tokens[1:])
+
+class Par2Profiles:
+    # NOTE: a table of par2 arguments by file size. A file gets the arguments
+    #       of the first row whose size it is smaller than. A row with size
+    #       `*` matches all files. Files matched by no row get `default`.
+
+    def __init__(self, profiles, default = None):
+        self._profiles = list(profiles)
+        self._default  = list(default or [])
+
+        sizes = [ x for (x, _) in self._profiles if x is not None ]
+
+        if sizes != sorted(sizes):
+            raise ValueError("Par2 profiles must be sorted by size")
+
+        if None in [ x for (x, _) in self._profiles[:-1] ]:
+            raise ValueError("Par2 profile '*' must be the last one")
+
+    @property
+    def profiles(self):
+        return self._profiles
+
+    def select(self, size):
+        for (max_size, par2_args) in self._profiles:
+            if (max_size is None) or (size < max_size):
+                return par2_args
+
+        return self._default
+
+    @staticmethod
+    def from_file(path, default = None):
+        profiles = []
+
+        with open(path, 'rt', encoding = 'utf-8') as f:
+            for (idx, line) in enumerate(f):
+                try:
+                    profile = parse_profile_line(line)
+                except ValueError as e:
+                    raise ValueError(
+                        f"Failed to parse par2 profile '{path}'"
+                        f" at line {idx + 1}: {e}"
+                    ) from e
+
+                if profile is not None:
+                    profiles.append(profile)
+
+        return Par2Profiles(profiles, default)
+
+def load_par2_profiles(spec, default = None):
+    # NOTE: `spec` is either 'builtin' or a path to a profile table
+    if spec == PAR2_PROFILES_BUILTIN:
+        return Par2Profiles(PAR2_BUILTIN_PROFILES, default)
+
+    return Par2Profiles.from_file(spec, default)
@@ -0,0 +1,113 @@
+import os
+import re
+import subprocess
+import threading
+
+from ..stats    import timed, PHASE_PAR2, PHASE_PAR2_WAIT, STAT_PAR2_BYTES
+from ..throttle import estimate_ops
+
+PAR2_THREADS_REGEXP = re.compile(r'^-t(\d+)$')
+
+def parse_par2_threads(par2_args):
+    for arg in par2_args:
+        match = PAR2_THREADS_REGEXP.match(arg)
+        if match:
+            return int(match.group(1))
+
+    return None
+
+def strip_thread_args(par2_args):
+    return [ x for x in par2_args if not PAR2_THREADS_REGEXP.match(x) ]
+
+class Par2Scheduler:
+    # NOTE: par2cmdline is multithreaded by itself. This scheduler bounds
+    #       both the number of par2 processes running at once and the total
+    #       number of threads these processes use, so that running several
+    #       par2 instances in parallel does not oversubscribe the machine.
+
+    def __init__(
+        self, max_procs = 1, max_threads = None, throttle = None, stats = None
+    ):
+        if max_threads is None:
+            max_threads = os.cpu_count() or 1
+
+        self._max_procs    = max(1, max_procs)
+        self._max_threads  = max(1, max_threads)
+        self._n_procs      = 0
+        self._n_threads    = 0
+        self._cond         = threading.Condition()
+        self._throttle     = throttle
+        self._stats        = stats
+
+    @property
+    def max_procs(self):
+        return self._max_procs
+
+    @property
+    def threads_per_proc(self):
+        return max(1, self._max_threads // self._max_procs)
+
+    def get_thread_args(self, par2_args):
+        # NOTE: explicit user thread settings are kept as is. Otherwise,
+        #       a single par2 process is allowed to use all the cores, like
+        #       it did before, and parallel ones split the cores between them.
+        n_threads = parse_par2_threads(par2_args)
+
+        if n_threads is not None:
+            return [ f'-t{n_threads}' ]
+
+        if self._max_procs == 1:
+            return []
+
+        return [ f'-t{self.threads_per_proc}' ]
+
+    def _get_cost(self, par2_args):
+        n_threads = parse_par2_threads(par2_args)
+
+        if n_threads is None:
+            return self._max_threads
+
+        return min(n_threads, self._max_threads)
+
+    def _can_start(self, cost):
+        if self._n_procs >= self._max_procs:
+            return False
+
+        # NOTE: let an oversized request run alone rather than never
+        return (self._n_procs == 0) or (
+            self._n_threads + cost <= self._max_threads
+        )
+
+    def run(self, par2_args, stdout = None, n_bytes = 0):
+        # NOTE: returns `subprocess.CompletedProcess` of the par2 call.
+        #       par2 reads are throttled as a whole, by charging `n_bytes`
+        #       before the process starts.
+        cost = self._get_cost(par2_args)
+
+        with timed(self._stats, PHASE_PAR2_WAIT):
+            if self._throttle is not None:
+                self._throttle.acquire(n_bytes, estimate_ops(n_bytes))
+
+            with self._cond:
+                self._cond.wait_for(lambda : self._can_start(cost))
+                self._n_procs   += 1
+                self._n_threads += cost
+
+        if self._stats is not None:
+            self._stats.count(STAT_PAR2_BYTES, n_bytes)
+
+        try:
+            with timed(self._stats, PHASE_PAR2):
+                # pylint: disable=(subprocess-run-check)
+                result = subprocess.run(
+                    par2_args,
+                    stdout = stdout,
+                    shell  = False
+                )
+        finally:
+            with self._cond:
+                self._n_procs   -= 1
+                self._n_threads -= cost
+                self._cond.notify_all()
+
+        return result
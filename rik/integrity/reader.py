@@ -0,0 +1,182 @@
+import contextlib
+import hashlib
+import mmap
+import os
+
+from ..stats   import STAT_BYTES_READ
+from .hashers  import HasherGroup
+
+READER_CHUNK_SIZE = 1024 * 1024
+
+def advise(fd, advice):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
+class FileReader:
+    # NOTE: chunks yielded by the reader are views into a reused buffer and
+    #       are only valid until the next chunk is requested
+
+    def __init__(
+        self,
+        chunk_size = None,
+        use_mmap   = False,
+        drop_cache = False,
+        throttle   = None,
+        stats      = None,
+    ):
+        # pylint: disable=too-many-arguments
+        if (chunk_size is not None) and (chunk_size <= 0):
+            raise ValueError(f"Chunk size must be positive: '{chunk_size}'")
+
+        # NOTE: whole files are hashed by `hashlib.file_digest`, which may
+        #       use a faster path of the interpreter (it already reads into a
+        #       reused buffer), unless a chunk size is given explicitly, or
+        #       reads are mapped or throttled
+        self._file_digest = (
+            hasattr(hashlib, 'file_digest') and (chunk_size is None)
+            and (not use_mmap) and (throttle is None)
+        )
+
+        self._chunk_size = chunk_size or READER_CHUNK_SIZE
+        self._use_mmap   = use_mmap
+        self._drop_cache = drop_cache
+        self._throttle   = throttle
+        self._stats      = stats
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    def _read_buffered(self, f, length = None):
+        buffer    = bytearray(self._chunk_size)
+        view      = memoryview(buffer)
+        remaining = length
+
+        try:
+            while (remaining is None) or (remaining > 0):
+                if (remaining is None) or (remaining >= self._chunk_size):
+                    size = f.readinto(buffer)
+                else:
+                    with view[:remaining] as target:
+                        size = f.readinto(target)
+
+                if not size:
+                    break
+
+                if remaining is not None:
+                    remaining -= size
+
+                if self._throttle is not None:
+                    self._throttle.acquire(size)
+
+                chunk = view[:size]
+                try:
+                    yield chunk
+                finally:
+                    chunk.release()
+        finally:
+            view.release()
+
+    def _read_mmap(self, f, offset = 0, length = None):
+        size = os.fstat(f.fileno()).st_size
+
+        if length is not None:
+            size = min(size, offset + length)
+
+        # NOTE: empty files cannot be mapped
+        if size <= offset:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+            if hasattr(m, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+
+            view = memoryview(m)
+
+            try:
+                for start in range(offset, size, self._chunk_size):
+                    chunk = view[start:min(start + self._chunk_size, size)]
+
+                    if self._throttle is not None:
+                        self._throttle.acquire(len(chunk))
+
+                    try:
+                        yield chunk
+                    finally:
+                        chunk.release()
+            finally:
+                view.release()
+
+    def _open_file(self, file_path):
+        # pylint: disable=consider-using-with
+        f = open(file_path, 'rb', buffering = 0)
+
+        if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+            advise(f.fileno(), os.POSIX_FADV_SEQUENTIAL)
+
+        return f
+
+    def _close_file(self, f):
+        # NOTE: keep scrubs from evicting useful data from the page cache
+        try:
+            if self._drop_cache and hasattr(os, 'POSIX_FADV_DONTNEED'):
+                advise(f.fileno(), os.POSIX_FADV_DONTNEED)
+        finally:
+            f.close()
+
+    @contextlib.contextmanager
+    def _open(self, file_path):
+        f = self._open_file(file_path)
+
+        try:
+            yield f
+        finally:
+            self._close_file(f)
+
+    def digest(self, file_path, hashers):
+        # NOTE: feeds the whole file to each of `hashers`
+        if not self._file_digest:
+            with contextlib.closing(self.read(file_path)) as chunks:
+                for chunk in chunks:
+                    for m in hashers:
+                        m.update(chunk)
+            return
+
+        target = hashers[0] if (len(hashers) == 1) else HasherGroup(hashers)
+
+        with self._open(file_path) as f:
+            hashlib.file_digest(f, lambda : target)
+
+            if self._stats is not None:
+                self._stats.count(STAT_BYTES_READ, f.tell())
+
+    def read(self, file_path, offset = 0, length = None):
+        # NOTE: reads `length` bytes starting at `offset`, or the whole file.
+        #       Callers that may stop early should close the generator, so
+        #       that the file is closed right away.
+        n_bytes = 0
+        f       = self._open_file(file_path)
+
+        try:
+            if self._use_mmap:
+                chunks = self._read_mmap(f, offset, length)
+            else:
+                if offset > 0:
+                    f.seek(offset)
+
+                chunks = self._read_buffered(f, length)
+
+            with contextlib.closing(chunks):
+                for chunk in chunks:
+                    n_bytes += len(chunk)
+                    yield chunk
+
+            if self._stats is not None:
+                self._stats.count(STAT_BYTES_READ, n_bytes)
+        finally:
+            self._close_file(f)
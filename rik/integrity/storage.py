@@ -0,0 +1,130 @@
+import logging
+import os
+
+LOGGER = logging.getLogger('rik')
+
+ENCODING = 'utf-8'
+
+# Suffixes of the files that accompany an integrity storage file
+STORAGE_LOG_SUFFIX = '.log'
+STORAGE_TMP_SUFFIX = '.tmp'
+
+def get_storage_names(name):
+    return [ name, name + STORAGE_LOG_SUFFIX, name + STORAGE_TMP_SUFFIX ]
+
+def write_atomic(path, lines):
+    # NOTE: readers see either the old or the new content, never a partial
+    #       one, even if the process or the machine crashes while writing
+    tmp_path = path + STORAGE_TMP_SUFFIX
+
+    try:
+        with open(tmp_path, 'wt', encoding = ENCODING) as f:
+            for line in lines:
+                f.write(line + '\n')
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def find_line_end(f, size, block_size = 64 * 1024):
+    # NOTE: returns the offset just past the last newline of the file
+    end = size
+
+    while end > 0:
+        start = max(0, end - block_size)
+        f.seek(start)
+
+        idx = f.read(end - start).rfind(b'\n')
+
+        if idx >= 0:
+            return start + idx + 1
+
+        end = start
+
+    return 0
+
+def append_lines(path, lines):
+    with open(path, 'a+b') as f:
+        size = f.seek(0, os.SEEK_END)
+
+        # NOTE: drop an incomplete last line of an interrupted append, so
+        #       that it does not get glued to the new ones
+        if size > 0:
+            end = find_line_end(f, size)
+
+            if end != size:
+                f.truncate(end)
+
+        for line in lines:
+            f.write((line + '\n').encode(ENCODING))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def read_lines(path, skip_incomplete = False):
+    # NOTE: yields lines without newlines. With `skip_incomplete`, a last
+    #       line without one, left by an interrupted append, is skipped.
+    with open(path, 'rt', encoding = ENCODING, newline = '\n') as f:
+        for line in f:
+            if line.endswith('\n'):
+                yield line[:-1]
+            elif skip_incomplete:
+                LOGGER.warning("Skipping incomplete last line of '%s'", path)
+            else:
+                yield line
+
+def find_line(path, key, get_key):
+    # NOTE: binary search in a file of lines sorted by `get_key(line)`.
+    #       Returns the line with the given key or None. Reads O(log N)
+    #       lines instead of the whole file.
+    with open(path, 'rb') as f:
+        lo = 0
+        hi = os.fstat(f.fileno()).st_size
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            # NOTE: move to the first line starting at or after `mid`
+            if mid > 0:
+                f.seek(mid - 1)
+                f.readline()
+            else:
+                f.seek(0)
+
+            start = f.tell()
+
+            if start >= hi:
+                hi = mid
+                continue
+
+            raw = f.readline()
+
+            if not raw.endswith(b'\n'):
+                hi = mid
+                continue
+
+            line     = raw[:-1].decode(ENCODING)
+            line_key = get_key(line)
+
+            if line_key == key:
+                return line
+
+            if line_key < key:
+                lo = start + len(raw)
+            else:
+                hi = mid
+
+    return None
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+
+from .sinks import ResultSink, RESULT_NAMES, RESULT_CODES
+
+LOGGER = logging.getLogger('rik')
+
+RECORD_RUN       = 'run'
+RECORD_DIRECTORY = 'directory'
+
+class DirectorySink(ResultSink):
+    # NOTE: forwards results of a single directory to the run sink and keeps
+    #       them, so that they can be journaled once the directory is done
+
+    def __init__(self, sink):
+        super().__init__()
+        self._sink    = sink
+        self._results = []
+
+    @property
+    def results(self):
+        return self._results
+
+    def _add(self, path, result, details = None):
+        self._results.append((path, result))
+
+    def add(self, path, result, details = None):
+        super().add(path, result, details)
+        self._sink.add(path, result, details)
+
+    def count(self, name, value = 1):
+        super().count(name, value)
+        self._sink.count(name, value)
+
+class Journal:
+    # NOTE: append-only log of directories whose processing has finished,
+    #       together with the results of their files. The first record
+    #       describes the run, so that a journal of a different run is never
+    #       resumed. Records are flushed, but not synced, as they are
+    #       written: after a crash at most a few directories are redone.
+
+    def __init__(self, path, run_info, resume = False):
+        self._path      = path
+        self._run_info  = run_info
+        self._completed = set()
+
+        if resume and os.path.isfile(path):
+            self._load()
+            mode = 'at'
+        elif os.path.isfile(path) and (os.path.getsize(path) > 0):
+            # NOTE: progress of an interrupted run is never thrown away
+            #       by accident
+            raise RuntimeError(
+                f"Journal '{path}' already exists. Resume its run or remove"
+                " it first."
+            )
+        else:
+            mode = 'wt'
+
+        # pylint: disable=consider-using-with
+        self._stream = open(path, mode, encoding = 'utf-8')
+
+        if mode == 'wt':
+            self._write({ 'type' : RECORD_RUN, **run_info })
+        else:
+            self._terminate_last_line()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def n_completed(self):
+        return len(self._completed)
+
+    def _iter_records(self, warn = False):
+        with open(self._path, 'rt', encoding = 'utf-8') as f:
+            for (idx, line) in enumerate(f):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # NOTE: the last record may be cut short by a crash
+                    if not warn:
+                        continue
+
+                    LOGGER.warning(
+                        "Ignoring damaged journal record %d in '%s'",
+                        idx + 1, self._path
+                    )
+
+    def _load(self):
+        for (idx, record) in enumerate(self._iter_records(warn = True)):
+            if idx == 0:
+                self._check_run(record)
+            elif record.get('type') == RECORD_DIRECTORY:
+                self._completed.add(record['path'])
+
+    def _check_run(self, record):
+        run_info = { k : v for (k, v) in record.items() if k != 'type' }
+
+        if (record.get('type') != RECORD_RUN) or (run_info != self._run_info):
+            raise RuntimeError(
+                f"Journal '{self._path}' belongs to a different run: "
+                f"'{run_info}'"
+            )
+
+    def _terminate_last_line(self):
+        with open(self._path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+
+            if f.tell() == 0:
+                return
+
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+
+        if last != b'\n':
+            self._stream.write('\n')
+
+    def _write(self, record):
+        self._stream.write(json.dumps(record) + '\n')
+        self._stream.flush()
+
+    def is_completed(self, directory):
+        return directory in self._completed
+
+    def replay(self, sink):
+        # NOTE: results are re-read from disk instead of being kept in memory
+        for record in self._iter_records():
+            if record.get('type') != RECORD_DIRECTORY:
+                continue
+
+            for (path, result) in record['results']:
+                sink.add(path, RESULT_CODES.get(result, result))
+
+    def add_directory(self, directory, results):
+        self._completed.add(directory)
+        self._write({
+            'type'    : RECORD_DIRECTORY,
+            'path'    : directory,
+            'results' : [
+                (path, RESULT_NAMES.get(result, str(result)))
+                    for (path, result) in results
+            ],
+        })
+
+    def close(self):
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._stream.close()
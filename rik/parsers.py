@@ -1,5 +1,42 @@
 import argparse
-from .integrity.hash import SUPPORTED_HASHES
+from .integrity.block_hash   import MERKLE_BLOCK_SIZE, MERKLE_INTEGRITIES
+from .integrity.digest_cache import DIGEST_CACHE_SIZE
+from .integrity.hash         import SUPPORTED_HASHES
+from .integrity.multi_hash   import HASH_NAME_SEPARATOR, parse_hash_names
+from .integrity.reader       import READER_CHUNK_SIZE
+from .path_constraints       import parse_size
+from .shard                  import (
+    SHARD_BALANCES, SHARD_BALANCE_HASH, parse_shard_spec
+)
+from .watch                  import WATCH_DELAY
+
+INTEGRITY_CHOICES = [ 'par2', ] + SUPPORTED_HASHES + MERKLE_INTEGRITIES
+
+def parse_integrity_name(name):
+    if name in INTEGRITY_CHOICES:
+        return name
+
+    hash_names = parse_hash_names(name)
+
+    if len(set(hash_names)) != len(hash_names):
+        raise argparse.ArgumentTypeError(f"duplicate hashes in: '{name}'")
+
+    if not all(x in SUPPORTED_HASHES for x in hash_names):
+        raise argparse.ArgumentTypeError(
+            f"invalid choice: '{name}' (choose from "
+            + ", ".join(INTEGRITY_CHOICES)
+            + f", or a '{HASH_NAME_SEPARATOR}' separated list of hashes)"
+        )
+
+    return HASH_NAME_SEPARATOR.join(hash_names)
+
+def parse_shard_arg(spec):
+    try:
+        return parse_shard_spec(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(
+            f"invalid shard: '{spec}' (expected I/N with 1 <= I <= N)"
+        ) from e
 
 def add_base_parser_options(parser):
 
@@ -11,29 +48,17 @@ def add_base_parser_options(parser):
         type    = str,
     )
 
-    parser.add_argument(
-        '-v', '--verbose',
-        action  = 'count',
-        default = 0,
-        dest    = 'verbose',
-        help    = "Increase verbosity",
-    )
-
-    parser.add_argument(
-        '-q', '--quiet',
-        action  = 'count',
-        default = 0,
-        dest    = 'quiet',
-        help    = "Decrease verbosity",
-    )
-
     parser.add_argument(
         '-i', '--integrity',
-        choices  = [ 'par2', ] + SUPPORTED_HASHES,
         default  = None,
         dest     = 'integrity',
-        help     = 'Integrity to use',
+        help     = (
+            'Integrity to use: ' + ', '.join(INTEGRITY_CHOICES)
+            + f". Several hashes can be given as '{HASH_NAME_SEPARATOR}'"
+            ' separated list'
+        ),
         required = True,
+        type     = parse_integrity_name,
     )
 
     parser.add_argument(
@@ -52,6 +77,185 @@ def add_base_parser_options(parser):
         help    = 'Exclude files/directories',
     )
 
+    parser.add_argument(
+        '-j', '--jobs',
+        default = 1,
+        dest    = 'jobs',
+        help    = 'Number of files to process in parallel',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--chunk-size',
+        default = None,
+        dest    = 'chunk_size',
+        help    = (
+            'Size of chunks to read files with (e.g. 64k, 4M).'
+            f' Default is {READER_CHUNK_SIZE // (1024 * 1024)}M, or'
+            ' hashlib.file_digest when available'
+        ),
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--mmap',
+        action  = 'store_true',
+        default = False,
+        dest    = 'use_mmap',
+        help    = 'Read files through mmap',
+    )
+
+    parser.add_argument(
+        '--drop-cache',
+        action  = 'store_true',
+        default = False,
+        dest    = 'drop_cache',
+        help    = 'Evict read files from the page cache',
+    )
+
+    parser.add_argument(
+        '--max-bandwidth',
+        default = 0,
+        dest    = 'max_bandwidth',
+        help    = 'Limit reads to SIZE bytes per second (0 is unlimited)',
+        metavar = 'SIZE',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--max-iops',
+        default = 0,
+        dest    = 'max_iops',
+        help    = 'Limit reads to N operations per second (0 is unlimited)',
+        metavar = 'N',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--throttle-file',
+        default = None,
+        dest    = 'throttle_file',
+        help    = 'Read updated throttle limits from PATH while running',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--idle-io',
+        action  = 'store_true',
+        default = False,
+        dest    = 'idle_io',
+        help    = 'Run with the idle I/O scheduling priority',
+    )
+
+    parser.add_argument(
+        '--par2-batch',
+        default = 0,
+        dest    = 'par2_batch_size',
+        help    = 'Group files smaller than SIZE into shared par2 sets',
+        metavar = 'SIZE',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--par2-profiles',
+        default = None,
+        dest    = 'par2_profiles',
+        help    = (
+            "Pick par2 arguments by file size: 'builtin' or a table file"
+            ' with rows of SIZE (or *) and par2 arguments'
+        ),
+        metavar = 'SPEC',
+    )
+
+    parser.add_argument(
+        '--block-size',
+        default = MERKLE_BLOCK_SIZE,
+        dest    = 'block_size',
+        help    = 'Size of blocks hashed by merkle integrities',
+        metavar = 'SIZE',
+        type    = parse_size,
+    )
+
+    parser.add_argument(
+        '--digest-cache',
+        default = DIGEST_CACHE_SIZE,
+        dest    = 'digest_cache_size',
+        help    = 'Number of hard-linked file digests to keep (0 disables)',
+        metavar = 'N',
+        type    = int,
+    )
+
+    parser.add_argument(
+        '--catalog',
+        default = None,
+        dest    = 'catalog',
+        help    = 'Keep hashes in a single SQLite catalog database',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--shard',
+        default = None,
+        dest    = 'shard',
+        help    = 'Process only shard I of N of the directories (e.g. 2/4)',
+        metavar = 'I/N',
+        type    = parse_shard_arg,
+    )
+
+    parser.add_argument(
+        '--shard-balance',
+        choices = SHARD_BALANCES,
+        default = SHARD_BALANCE_HASH,
+        dest    = 'shard_balance',
+        help    = (
+            'Split directories between shards by hashes of their paths,'
+            ' or by their sizes'
+        ),
+    )
+
+    parser.add_argument(
+        '--shard-plan',
+        default = None,
+        dest    = 'shard_plan',
+        help    = (
+            'Assignment of directories to shards balanced by size, shared by'
+            ' all shards (written by the first one)'
+        ),
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--journal',
+        default = None,
+        dest    = 'journal',
+        help    = 'Record finished directories in a checkpoint journal',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--resume',
+        action  = 'store_true',
+        default = False,
+        dest    = 'resume',
+        help    = 'Skip directories finished according to the journal',
+    )
+
+    parser.add_argument(
+        '--stats',
+        default = None,
+        dest    = 'stats',
+        help    = 'Write timing and throughput statistics to a file',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--stats-format',
+        choices = [ 'json', 'prometheus' ],
+        default = 'json',
+        dest    = 'stats_format',
+        help    = 'Format of the statistics file',
+    )
+
     parser.add_argument(
         default = None,
         dest    = 'iargs',
@@ -60,6 +264,48 @@ def add_base_parser_options(parser):
         help    = 'Arguments for integrity',
     )
 
+def add_output_parser_options(parser):
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action  = 'count',
+        default = 0,
+        dest    = 'verbose',
+        help    = "Increase verbosity",
+    )
+
+    parser.add_argument(
+        '-q', '--quiet',
+        action  = 'count',
+        default = 0,
+        dest    = 'quiet',
+        help    = "Decrease verbosity",
+    )
+
+    parser.add_argument(
+        '--output',
+        choices = [ 'text', 'jsonl' ],
+        default = 'text',
+        dest    = 'output',
+        help    = 'Format of results: text summary or stream of JSON lines',
+    )
+
+    parser.add_argument(
+        '--output-file',
+        default = None,
+        dest    = 'output_file',
+        help    = 'Write JSON lines results to a file instead of stdout',
+        metavar = 'PATH',
+    )
+
+    parser.add_argument(
+        '--list-all',
+        action  = 'store_true',
+        default = False,
+        dest    = 'list_all',
+        help    = 'List successful and skipped files in the text summary',
+    )
+
 def add_create_parser(subparsers, parents):
     parser = subparsers.add_parser(
         'create', help = 'Create Integrity', parents = parents
@@ -71,17 +317,92 @@ def add_create_parser(subparsers, parents):
         dest    = 'recalc',
         help    = "Recalculate and overwrite existing integirities",
     )
+    parser.add_argument(
+        '--metadata',
+        action  = 'store_true',
+        default = False,
+        dest    = 'metadata',
+        help    = "Store file size, mtime, ctime and inode along with hashes",
+    )
 
 def add_verify_parser(subparsers, parents):
-    _parser = subparsers.add_parser(
+    parser = subparsers.add_parser(
         'verify', help = 'Verify Integrity', parents = parents
     )
+    parser.add_argument(
+        '--quick',
+        action  = 'store_true',
+        default = False,
+        dest    = 'quick',
+        help    = "Rehash only files whose stored metadata has changed",
+    )
+
+def add_repair_parser(subparsers, parents):
+    parser = subparsers.add_parser(
+        'repair', help = 'Repair Files Failed by Verification',
+        parents = parents
+    )
+    parser.add_argument(
+        '--results',
+        default  = None,
+        dest     = 'results',
+        help     = (
+            "JSON lines results of the verification to repair after"
+            " (default: failures recorded in --catalog)"
+        ),
+        metavar  = 'PATH',
+    )
 
 def add_prune_parser(subparsers, parents):
     _parser = subparsers.add_parser(
         'prune', help = 'Delete Obsolete Integrities', parents = parents
     )
 
+def add_watch_parser(subparsers, parents):
+    parser = subparsers.add_parser(
+        'watch', help = 'Keep Integrity Up to Date with Changes',
+        parents = parents
+    )
+    parser.add_argument(
+        '--delay',
+        default = WATCH_DELAY,
+        dest    = 'delay',
+        help    = (
+            'Seconds without changes to wait before processing a directory.'
+            f' Default is {WATCH_DELAY:g}'
+        ),
+        metavar = 'SECONDS',
+        type    = float,
+    )
+    parser.add_argument(
+        '--metadata',
+        action  = 'store_true',
+        default = False,
+        dest    = 'metadata',
+        help    = "Store file size, mtime, ctime and inode along with hashes",
+    )
+
+def add_import_parser(subparsers, parents):
+    _parser = subparsers.add_parser(
+        'import', help = 'Import Hash Files into Catalog', parents = parents
+    )
+
+def add_export_parser(subparsers, parents):
+    _parser = subparsers.add_parser(
+        'export', help = 'Export Catalog into Hash Files', parents = parents
+    )
+
+def add_merge_parser(subparsers, parents):
+    parser = subparsers.add_parser(
+        'merge', help = 'Merge JSON Lines Results', parents = parents
+    )
+    parser.add_argument(
+        'results',
+        help    = "JSON lines results to merge, e.g. of shards",
+        metavar = 'RESULTS',
+        nargs   = '+',
+    )
+
 def create_rik_parser():
     parser = argparse.ArgumentParser(
         description = "Recursive Integrity keeper"
@@ -90,12 +411,21 @@ def create_rik_parser():
     base_parser = argparse.ArgumentParser(add_help = False)
     add_base_parser_options(base_parser)
 
+    output_parser = argparse.ArgumentParser(add_help = False)
+    add_output_parser_options(output_parser)
+
+    parents    = [ base_parser, output_parser ]
     subparsers = parser.add_subparsers(dest = 'cmd', help = 'Command')
     subparsers.required = True
 
-    add_create_parser(subparsers, [ base_parser, ])
-    add_verify_parser(subparsers, [ base_parser, ])
-    add_prune_parser (subparsers, [ base_parser, ])
+    add_create_parser(subparsers, parents)
+    add_verify_parser(subparsers, parents)
+    add_repair_parser(subparsers, parents)
+    add_prune_parser (subparsers, parents)
+    add_watch_parser (subparsers, parents)
+    add_import_parser(subparsers, parents)
+    add_export_parser(subparsers, parents)
+    add_merge_parser (subparsers, [ output_parser, ])
 
     return parser
 
@@ -1,5 +1,5 @@
 import glob
-import os
+import operator
 import re
 
 # pylint: disable=too-few-public-methods
@@ -11,13 +11,89 @@ SUFFIX_SIZE_MAP = {
     'g' : 1024 * 1024 * 1024,
 }
 
+def parse_size(size):
+    if size.isdigit():
+        return int(size)
+
+    if not size[:-1].isdigit():
+        raise ValueError(f"Failed to parse size: '{size}'")
+
+    suffix = size[-1].lower()
+
+    if suffix not in SUFFIX_SIZE_MAP:
+        raise ValueError(f'Unknown size suffix: {suffix}')
+
+    return int(size[:-1]) * SUFFIX_SIZE_MAP[suffix]
+
+SIZE_OPERATORS = {
+    '>'  : operator.gt,
+    '>=' : operator.ge,
+    '<'  : operator.lt,
+    '<=' : operator.le,
+    '==' : operator.eq,
+}
+
+PATH_SEPARATOR = '/'
+
+def translate_path_glob(glob_expr):
+    # NOTE: unlike `fnmatch.translate`, wildcards do not match path
+    #       separators, except for `**` that matches any number of
+    #       directories
+    result = []
+    idx    = 0
+
+    while idx < len(glob_expr):
+        c = glob_expr[idx]
+
+        if glob_expr.startswith('**/', idx):
+            result.append('(?:.*/)?')
+            idx += 2
+        elif glob_expr.startswith('**', idx):
+            result.append('.*')
+            idx += 1
+        elif c == '*':
+            result.append('[^/]*')
+        elif c == '?':
+            result.append('[^/]')
+        elif (c == '[') and (glob_expr.find(']', idx + 2) > 0):
+            end   = glob_expr.find(']', idx + 2)
+            chars = glob_expr[idx + 1:end].replace('\\', '\\\\')
+
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+
+            result.append(f'[{chars}]')
+            idx = end
+        else:
+            result.append(re.escape(c))
+
+        idx += 1
+
+    return ''.join(result)
+
+def is_path_glob(glob_expr):
+    return PATH_SEPARATOR in glob_expr
+
+def translate_glob(glob_expr):
+    # NOTE: returns a regex to be searched in the full path for patterns
+    #       with separators, and a regex to be matched against the base name
+    #       for the others. Patterns starting with a separator are matched
+    #       against the full path, the other ones against its last components.
+    if not is_path_glob(glob_expr):
+        return glob.fnmatch.translate(glob_expr)
+
+    if glob_expr.startswith(PATH_SEPARATOR):
+        return '^' + translate_path_glob(glob_expr) + r'\Z'
+
+    return '(?:^|/)' + translate_path_glob(glob_expr) + r'\Z'
+
 class PathConstraint:
     # pylint: disable=no-self-use
 
     def __init__(self):
         pass
 
-    def check(self, path):
+    def check(self, entry):
         raise RuntimeError("Not Implemented")
 
 class FileSizeConstraint(PathConstraint):
@@ -40,35 +116,16 @@ class FileSizeConstraint(PathConstraint):
                 f"Size must be str, int, or float, not '{size}'"
             )
 
-        suffix = size[-1].lower()
+        self._size = parse_size(size)
 
-        if suffix in SUFFIX_SIZE_MAP:
-            size = int(size[:-1]) * SUFFIX_SIZE_MAP[suffix]
-        else:
-            raise ValueError(f'Unknown size suffix: {suffix}')
-
-        self._size = size
+    def check_size(self, size):
+        return SIZE_OPERATORS.get(self._sign, operator.eq)(size, self._size)
 
-    def check(self, path):
-        # pylint: disable=superfluous-parens
-        if not os.path.isfile(path):
+    def check(self, entry):
+        if not entry.is_file():
             return False
 
-        size = os.path.getsize(path)
-
-        if self._sign == '>':
-            return (size > self._size)
-
-        if self._sign == '>=':
-            return (size >= self._size)
-
-        if self._sign == '<':
-            return (size < self._size)
-
-        if self._sign == '<=':
-            return (size <= self._size)
-
-        return (size == self._size)
+        return self.check_size(entry.stat().st_size)
 
     @staticmethod
     def from_string(spec):
@@ -100,11 +157,82 @@ class GlobConstraint(PathConstraint):
 
     def __init__(self, glob_expr, inverse):
         super().__init__()
-        self._glob_re = re.compile(glob.fnmatch.translate(glob_expr))
-        self._inverse = inverse
+        self._glob_expr = glob_expr
+        self._glob_re   = re.compile(translate_glob(glob_expr))
+        self._is_path   = is_path_glob(glob_expr)
+        self._inverse   = inverse
+
+    @property
+    def glob_expr(self):
+        return self._glob_expr
 
-    def check(self, path):
+    @property
+    def inverse(self):
+        return self._inverse
+
+    def check(self, entry):
         # pylint: disable=superfluous-parens
-        basename = os.path.basename(path)
-        return ((self._glob_re.match(basename) is not None) != self._inverse)
+        if self._is_path:
+            matched = (self._glob_re.search(entry.path) is not None)
+        else:
+            matched = (self._glob_re.match(entry.name) is not None)
+
+        return (matched != self._inverse)
+
+def combine_regexps(regexps):
+    if not regexps:
+        return None
+
+    return re.compile('|'.join(f'(?:{x})' for x in regexps))
+
+class ConstraintSet(PathConstraint):
+    # NOTE: checks a list of constraints at once. Exclude patterns are
+    #       combined into one regex for base names and one for full paths,
+    #       and the file size is looked up once for all size constraints.
+    #       Other constraints are checked one by one, in order.
+
+    def __init__(self, constraints):
+        super().__init__()
+
+        name_regexps = []
+        path_regexps = []
+
+        self._sizes  = []
+        self._others = []
+
+        for constraint in constraints:
+            if isinstance(constraint, GlobConstraint) and constraint.inverse:
+                regexp = translate_glob(constraint.glob_expr)
+
+                if is_path_glob(constraint.glob_expr):
+                    path_regexps.append(regexp)
+                else:
+                    name_regexps.append(regexp)
+
+            elif isinstance(constraint, FileSizeConstraint):
+                self._sizes.append(constraint)
+            else:
+                self._others.append(constraint)
+
+        self._name_re = combine_regexps(name_regexps)
+        self._path_re = combine_regexps(path_regexps)
+
+    def check(self, entry):
+        # pylint: disable=too-many-return-statements
+        if (self._name_re is not None) and self._name_re.match(entry.name):
+            return False
+
+        if (self._path_re is not None) and self._path_re.search(entry.path):
+            return False
+
+        if self._sizes:
+            if not entry.is_file():
+                return False
+
+            size = entry.stat().st_size
+
+            if not all(x.check_size(size) for x in self._sizes):
+                return False
+
+        return all(x.check(entry) for x in self._others)
 
@@ -0,0 +1,82 @@
+import os
+import stat
+
+class PathEntry:
+    # NOTE: mimics `os.DirEntry` for paths that were not obtained with
+    #       `os.scandir` (e.g. the walk root). The stat result is cached.
+
+    def __init__(self, path):
+        self.path  = path
+        self.name  = os.path.basename(path)
+        self._stat = None
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"<PathEntry '{self.path}'>"
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+
+        return self._stat
+
+    def _check_mode(self, func):
+        try:
+            return func(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_file(self):
+        return self._check_mode(stat.S_ISREG)
+
+    def is_dir(self):
+        return self._check_mode(stat.S_ISDIR)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+def scan_directory(path):
+    dirs  = []
+    files = []
+
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                dirs.append(entry)
+            else:
+                files.append(entry)
+
+    return (dirs, files)
+
+def walk_entries(root_entry):
+    # NOTE: this is `os.walk` that yields directory entries with cached stat
+    #       results instead of names. Like `os.walk`, it does not descend into
+    #       symlinked directories, skips unreadable ones and allows callers to
+    #       modify the yielded `dirs` list to prune the traversal.
+    stack = [ root_entry ]
+
+    while stack:
+        top = stack.pop()
+
+        try:
+            dirs, files = scan_directory(top.path)
+        except OSError:
+            continue
+
+        yield (top, dirs, files)
+
+        for entry in reversed(dirs):
+            try:
+                is_symlink = entry.is_symlink()
+            except OSError:
+                is_symlink = True
+
+            if not is_symlink:
+                stack.append(entry)
@@ -0,0 +1,190 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+
+from .funcs import build_constraints, walk_directories
+from .sinks import ResultSink
+
+LOGGER = logging.getLogger('rik')
+
+SHARD_SEPARATOR = '/'
+
+SHARD_BALANCE_HASH = 'hash'
+SHARD_BALANCE_SIZE = 'size'
+SHARD_BALANCES     = [ SHARD_BALANCE_HASH, SHARD_BALANCE_SIZE ]
+
+def parse_shard_spec(spec):
+    # NOTE: shards are numbered from 1, e.g. '1/4' to '4/4'
+    index, sep, count = spec.partition(SHARD_SEPARATOR)
+
+    try:
+        index = int(index)
+        count = int(count)
+    except ValueError:
+        sep = None
+
+    if (not sep) or (count < 1) or (not 1 <= index <= count):
+        raise ValueError(f"Failed to parse shard: '{spec}'")
+
+    return (index, count)
+
+def get_relative_dir(root_dir, dir_path):
+    # NOTE: shards are assigned by paths relative to the walk root, so that
+    #       hosts mounting the tree at different places agree on them
+    return os.path.relpath(dir_path, root_dir).replace(os.sep, '/')
+
+def hash_directory(rel_path, count):
+    digest = hashlib.blake2b(
+        rel_path.encode('utf-8', 'surrogateescape'), digest_size = 8
+    ).digest()
+
+    return int.from_bytes(digest, 'big') % count
+
+def get_directory_size(files, constraints):
+    # NOTE: excluded files, e.g. integrity storages written by other shards,
+    #       are not counted, so that all shards see the same sizes
+    result = 0
+
+    for entry in files:
+        try:
+            if entry.is_file() and constraints.check(entry):
+                result += entry.stat().st_size
+        except OSError:
+            pass
+
+    return result
+
+def balance_directories(root_dir, dir_constraints, count):
+    # NOTE: assigns the largest directories first, each to the shard with
+    #       the fewest bytes so far (ties go to the lower shard). Directories
+    #       are sorted by size and path, so every shard computes the same
+    #       assignment as long as the tree does not change meanwhile.
+    sizes = []
+
+    if dir_constraints is None:
+        dir_constraints = build_constraints()[0]
+
+    for root_entry, files in walk_directories(
+        root_dir, dir_constraints, ResultSink()
+    ):
+        sizes.append((
+            -get_directory_size(files, dir_constraints),
+            get_relative_dir(root_dir, root_entry.path)
+        ))
+
+    sizes.sort()
+
+    loads  = [ (0, idx) for idx in range(count) ]
+    result = {}
+
+    for (neg_size, rel_path) in sizes:
+        load, idx = heapq.heappop(loads)
+        result[rel_path] = idx
+        heapq.heappush(loads, (load - neg_size, idx))
+
+    return result
+
+def save_shard_plan(path, count, assignment):
+    # NOTE: the plan is written to a temporary file and linked into place,
+    #       which fails if another shard has written its plan meanwhile
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    plan     = { 'shards' : count, 'directories' : assignment }
+
+    try:
+        with open(tmp_path, 'wt', encoding = 'utf-8') as f:
+            json.dump(plan, f, indent = 1, sort_keys = True)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.link(tmp_path, path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def load_shard_plan(path, count):
+    with open(path, 'rt', encoding = 'utf-8') as f:
+        try:
+            plan = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"Failed to parse shard plan '{path}'") from e
+
+    if (not isinstance(plan, dict)) or (plan.get('shards', None) != count):
+        raise ValueError(
+            f"Shard plan '{path}' is not a plan for {count} shards"
+        )
+
+    return plan['directories']
+
+def get_shard_plan(path, root_dir, dir_constraints, count):
+    # NOTE: the first shard to start balances the tree and writes the plan.
+    #       All shards then use the written plan, so that they agree on the
+    #       owners of directories even if the tree changes meanwhile.
+    if not os.path.exists(path):
+        LOGGER.info("Balancing %d shards by directory sizes", count)
+        assignment = balance_directories(root_dir, dir_constraints, count)
+
+        try:
+            save_shard_plan(path, count, assignment)
+        except FileExistsError:
+            LOGGER.info("Using shard plan '%s' of another shard", path)
+
+    return load_shard_plan(path, count)
+
+class Shard:
+    # NOTE: selects the directories processed by one of several rik runs
+    #       that split a tree between them. Each directory, and so each
+    #       integrity storage, belongs to exactly one shard.
+
+    def __init__(self, root_dir, index, count, assignment = None):
+        self._root_dir   = root_dir
+        self._index      = index
+        self._count      = count
+        self._assignment = assignment
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def count(self):
+        return self._count
+
+    def __str__(self):
+        return f"{self._index}{SHARD_SEPARATOR}{self._count}"
+
+    def owns(self, dir_path):
+        rel_path = get_relative_dir(self._root_dir, dir_path)
+        idx      = None
+
+        if self._assignment is not None:
+            idx = self._assignment.get(rel_path, None)
+
+        # NOTE: directories created after balancing are hashed
+        if idx is None:
+            idx = hash_directory(rel_path, self._count)
+
+        return (idx == self._index - 1)
+
+def create_shard(
+    root_dir, index, count, balance = SHARD_BALANCE_HASH,
+    dir_constraints = None, plan_path = None
+):
+    # pylint: disable=too-many-arguments
+    # NOTE: balancing by sizes needs a plan shared by all shards
+    assignment = None
+
+    if balance == SHARD_BALANCE_SIZE:
+        if plan_path is None:
+            raise ValueError("Balancing shards by size requires a shard plan")
+
+        assignment = get_shard_plan(
+            plan_path, root_dir, dir_constraints, count
+        )
+    elif balance != SHARD_BALANCE_HASH:
+        raise ValueError(f"Unknown shard balance: '{balance}'")
+
+    return Shard(root_dir, index, count, assignment)
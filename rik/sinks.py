@@ -0,0 +1,210 @@
+import collections
+import json
+import sys
+import threading
+
+from .consts import (
+    RESULT_OK, RESULT_NEW, RESULT_DEL, RESULT_SKIP, RESULT_ERROR,
+    RESULT_MISMATCH
+)
+
+RESULT_NAMES = {
+    RESULT_OK       : 'ok',
+    RESULT_NEW      : 'new',
+    RESULT_DEL      : 'del',
+    RESULT_SKIP     : 'skip',
+    RESULT_ERROR    : 'error',
+    RESULT_MISMATCH : 'mismatch',
+}
+
+RESULT_CODES = { v : k for (k, v) in RESULT_NAMES.items() }
+
+# Results that are listed in the summary by default
+SUMMARY_RESULTS = [ RESULT_NEW, RESULT_DEL, RESULT_ERROR, RESULT_MISMATCH ]
+
+RECORD_RESULT  = 'result'
+RECORD_SUMMARY = 'summary'
+
+# Fields of result records that are not result details
+RECORD_FIELDS = [ 'type', 'path', 'result' ]
+
+def read_records(path):
+    # NOTE: yields records of JSON Lines results written by JsonlSink
+    with open(path, 'rt', encoding = 'utf-8') as f:
+        for (idx, line) in enumerate(f):
+            if not line.strip():
+                continue
+
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise RuntimeError(
+                    f"Failed to parse results '{path}' at line {idx + 1}: {e}"
+                ) from e
+
+def get_record_details(record):
+    return { k : v for (k, v) in record.items() if k not in RECORD_FIELDS }
+
+def load_results(path, results = None):
+    # NOTE: reads JSON Lines results written by JsonlSink and returns
+    #       { path : details } of files with one of `results`. For a file
+    #       listed several times, the last record wins.
+    if results is None:
+        results = [ RESULT_MISMATCH ]
+
+    names  = set(RESULT_NAMES[x] for x in results)
+    result = {}
+
+    for record in read_records(path):
+        if record.get('type', None) != RECORD_RESULT:
+            continue
+
+        if record.get('result', None) in names:
+            result[record['path']] = get_record_details(record)
+        else:
+            result.pop(record.get('path', None), None)
+
+    return result
+
+def merge_results(paths, sink):
+    # NOTE: combines JSON Lines results of several runs, e.g. of shards of
+    #       one tree, into `sink`. For a file listed several times, the last
+    #       record wins. Counters of the summary records are added up.
+    records = {}
+
+    for path in paths:
+        for record in read_records(path):
+            record_type = record.get('type', None)
+
+            if record_type == RECORD_RESULT:
+                records.pop(record['path'], None)
+                records[record['path']] = record
+            elif record_type == RECORD_SUMMARY:
+                for (name, value) in record.get('counters', {}).items():
+                    sink.count(name, value)
+
+    for (path, record) in records.items():
+        result = RESULT_CODES.get(record['result'], None)
+
+        if result is None:
+            raise RuntimeError(
+                f"Unknown result '{record['result']}' of '{path}'"
+            )
+
+        sink.add(path, result, get_record_details(record) or None)
+
+    return sink
+
+class ResultSink:
+    # NOTE: receives results as they are produced. Keeps running counts of
+    #       results and of auxiliary events (e.g. pruned directories).
+    #       Subclasses decide what else to do with each result.
+
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._counts   = collections.Counter()
+        self._counters = collections.Counter()
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def counters(self):
+        return self._counters
+
+    @property
+    def n_total(self):
+        return sum(self._counts.values())
+
+    def _add(self, path, result, details = None):
+        pass
+
+    def add(self, path, result, details = None):
+        # NOTE: `details` is an optional dict of extra information about
+        #       the result, e.g. damaged byte ranges of a mismatched file
+        with self._lock:
+            self._counts[result] += 1
+            self._add(path, result, details)
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SummarySink(ResultSink):
+    # NOTE: remembers paths of the selected results only, so that memory
+    #       usage is proportional to the number of problems, not files
+
+    def __init__(self, results = None):
+        super().__init__()
+
+        if results is None:
+            results = SUMMARY_RESULTS
+
+        self._results = set(results)
+        self._entries = collections.defaultdict(list)
+
+    @property
+    def listed_results(self):
+        return self._results
+
+    def get_entries(self, result):
+        return self._entries.get(result, [])
+
+    def _add(self, path, result, details = None):
+        if result in self._results:
+            self._entries[result].append(path)
+
+class JsonlSink(ResultSink):
+    # NOTE: streams results as JSON Lines records. A summary record with the
+    #       total counts is written at the end.
+
+    def __init__(self, path = None):
+        super().__init__()
+        self._path = path
+
+        if path is None:
+            self._stream = sys.stdout
+        else:
+            # pylint: disable=consider-using-with
+            self._stream = open(path, 'wt', encoding = 'utf-8')
+
+    def _write(self, record):
+        self._stream.write(json.dumps(record) + '\n')
+
+    def _add(self, path, result, details = None):
+        record = {
+            'type'   : RECORD_RESULT,
+            'path'   : path,
+            'result' : RESULT_NAMES.get(result, str(result)),
+        }
+
+        if details:
+            record.update(details)
+
+        self._write(record)
+
+    def close(self):
+        with self._lock:
+            self._write({
+                'type'     : RECORD_SUMMARY,
+                'counts'   : {
+                    RESULT_NAMES.get(k, str(k)) : v
+                        for (k, v) in self._counts.items()
+                },
+                'counters' : dict(self._counters),
+            })
+
+            if self._path is None:
+                self._stream.flush()
+            else:
+                self._stream.close()
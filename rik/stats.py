@@ -0,0 +1,241 @@
+import collections
+import contextlib
+import heapq
+import json
+import os
+import resource
+import threading
+import time
+
+from .sinks import RESULT_NAMES
+
+PHASE_WALK      = 'walk'
+PHASE_LOAD      = 'load'
+PHASE_FILE      = 'file'
+PHASE_FLUSH     = 'flush'
+PHASE_PRUNE     = 'prune'
+PHASE_SAVE      = 'save'
+PHASE_PAR2      = 'par2'
+PHASE_PAR2_WAIT = 'par2_wait'
+
+STAT_BYTES_READ = 'bytes_read'
+STAT_PAR2_BYTES = 'par2_bytes'
+
+SLOWEST_FILES       = 'files'
+SLOWEST_DIRECTORIES = 'directories'
+
+# Number of the slowest files and directories to report
+STATS_N_SLOWEST = 10
+
+PROMETHEUS_PREFIX = 'rik_'
+
+def timed(stats, phase, key = None, category = None):
+    # NOTE: convenience wrapper for optional stats
+    if stats is None:
+        return contextlib.nullcontext()
+
+    return stats.timer(phase, key, category)
+
+def timed_iter(iterable, stats, phase):
+    # NOTE: times how long each item of `iterable` takes to produce
+    iterator = iter(iterable)
+
+    while True:
+        with timed(stats, phase):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+
+        yield item
+
+def get_cpu_times():
+    usage_self     = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        'self'     : (usage_self.ru_utime,     usage_self.ru_stime),
+        'children' : (usage_children.ru_utime, usage_children.ru_stime),
+    }
+
+def escape_label(value):
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    return value.replace('\n', '\\n')
+
+def format_metric(name, help_text, samples):
+    name   = PROMETHEUS_PREFIX + name
+    result = [ f"# HELP {name} {help_text}", f"# TYPE {name} gauge" ]
+
+    for (labels, value) in samples:
+        if labels:
+            spec = ','.join(f'{k}="{escape_label(v)}"' for (k, v) in labels)
+            result.append(f"{name}{{{spec}}} {value}")
+        else:
+            result.append(f"{name} {value}")
+
+    return result
+
+def format_prometheus(report):
+    # NOTE: node_exporter textfile collector format. Paths of the slowest
+    #       entries are left out to keep the number of series bounded.
+    phases = report['phases'].items()
+    lines  = []
+
+    lines += format_metric(
+        'run_seconds', "Wall time of the run.", [ ((), report['elapsed']) ]
+    )
+    lines += format_metric(
+        'files', "Number of processed files.", [ ((), report['files']) ]
+    )
+    lines += format_metric(
+        'files_per_second', "Processed files per second.",
+        [ ((), report['files_per_s']) ]
+    )
+    lines += format_metric(
+        'read_bytes', "Number of bytes read by rik itself.",
+        [ ((), report['bytes_read']) ]
+    )
+    lines += format_metric(
+        'read_bytes_per_second', "Read throughput of rik itself.",
+        [ ((), report['bytes_per_s']) ]
+    )
+    lines += format_metric(
+        'par2_bytes', "Number of bytes passed to par2 processes.",
+        [ ((), report['counters'].get(STAT_PAR2_BYTES, 0)) ]
+    )
+    lines += format_metric(
+        'phase_seconds', "Time spent in each phase.",
+        [ ((('phase', k),), v['seconds']) for (k, v) in phases ]
+    )
+    lines += format_metric(
+        'phase_calls', "Number of times each phase ran.",
+        [ ((('phase', k),), v['calls']) for (k, v) in phases ]
+    )
+    lines += format_metric(
+        'cpu_seconds',
+        "CPU time of rik (self) and of par2 processes (children).",
+        [
+            ((('process', k), ('mode', m)), v[m])
+                for (k, v) in report['cpu'].items() for m in v
+        ]
+    )
+
+    if 'results' in report:
+        lines += format_metric(
+            'results', "Number of files by result.",
+            [ ((('result', k),), v) for (k, v) in report['results'].items() ]
+        )
+
+    return '\n'.join(lines) + '\n'
+
+class RunStats:
+    # NOTE: accumulates time spent in each phase of a run, the amount of
+    #       data read and the slowest files and directories. Safe to use
+    #       from several threads.
+
+    def __init__(self, n_slowest = STATS_N_SLOWEST):
+        self._lock      = threading.Lock()
+        self._n_slowest = n_slowest
+        self._phases    = collections.defaultdict(lambda : [ 0, 0.0 ])
+        self._counters  = collections.Counter()
+        self._slowest   = collections.defaultdict(list)
+        self._start     = time.perf_counter()
+        self._cpu_start = get_cpu_times()
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _add_slowest(self, category, key, seconds):
+        # NOTE: min-heap of bounded size keeps the slowest entries
+        heap = self._slowest[category]
+
+        if len(heap) < self._n_slowest:
+            heapq.heappush(heap, (seconds, key))
+        elif seconds > heap[0][0]:
+            heapq.heapreplace(heap, (seconds, key))
+
+    def add_slowest(self, category, key, seconds):
+        with self._lock:
+            self._add_slowest(category, key, seconds)
+
+    def add_time(self, phase, seconds, key = None, category = None):
+        with self._lock:
+            self._phases[phase][0] += 1
+            self._phases[phase][1] += seconds
+
+            if key is not None:
+                self._add_slowest(category or phase, key, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, phase, key = None, category = None):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start, key, category)
+
+    def get_report(self, sink = None):
+        elapsed = time.perf_counter() - self._start
+        cpu_end = get_cpu_times()
+
+        with self._lock:
+            phases   = {
+                k : { 'calls' : v[0], 'seconds' : v[1] }
+                    for (k, v) in sorted(self._phases.items())
+            }
+            counters = dict(self._counters)
+            slowest  = {
+                k : [
+                    { 'path' : p, 'seconds' : s }
+                        for (s, p) in sorted(v, reverse = True)
+                ]
+                for (k, v) in self._slowest.items()
+            }
+
+        cpu = {
+            k : {
+                'user'   : cpu_end[k][0] - self._cpu_start[k][0],
+                'system' : cpu_end[k][1] - self._cpu_start[k][1],
+            }
+            for k in cpu_end
+        }
+
+        n_files = sink.n_total if (sink is not None) else 0
+        n_bytes = counters.get(STAT_BYTES_READ, 0)
+
+        report = {
+            'elapsed'     : elapsed,
+            'files'       : n_files,
+            'files_per_s' : n_files / elapsed if elapsed > 0 else 0,
+            'bytes_read'  : n_bytes,
+            'bytes_per_s' : n_bytes / elapsed if elapsed > 0 else 0,
+            'phases'      : phases,
+            'counters'    : counters,
+            'cpu'         : cpu,
+            'slowest'     : slowest,
+        }
+
+        if sink is not None:
+            report['results'] = {
+                RESULT_NAMES.get(k, str(k)) : v
+                    for (k, v) in sink.counts.items()
+            }
+            report['sink_counters'] = dict(sink.counters)
+
+        return report
+
+    def save_json(self, path, sink = None):
+        with open(path, 'wt', encoding = 'utf-8') as f:
+            json.dump(self.get_report(sink), f, indent = 4)
+
+    def save_prometheus(self, path, sink = None):
+        # NOTE: node_exporter may read the file at any time, so it is
+        #       replaced atomically
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, 'wt', encoding = 'utf-8') as f:
+            f.write(format_prometheus(self.get_report(sink)))
+
+        os.replace(tmp_path, path)
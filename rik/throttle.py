@@ -0,0 +1,212 @@
+import ctypes
+import logging
+import os
+import platform
+import threading
+import time
+
+from .path_constraints import parse_size
+
+LOGGER = logging.getLogger('rik')
+
+# Granularity of I/O operations of external tools, like par2, whose reads
+# cannot be throttled one by one
+THROTTLE_OP_SIZE = 1024 * 1024
+
+# Interval between checks of the control file for modifications [s]
+THROTTLE_CHECK_INTERVAL = 1.0
+
+THROTTLE_BANDWIDTH = 'max-bandwidth'
+THROTTLE_IOPS      = 'max-iops'
+
+IOPRIO_CLASS_IDLE  = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+IOPRIO_SET_SYSCALLS = {
+    'x86_64'  : 251,
+    'i386'    : 289,
+    'i686'    : 289,
+    'aarch64' : 30,
+    'riscv64' : 30,
+    'armv7l'  : 314,
+    'ppc64le' : 273,
+    's390x'   : 282,
+}
+
+def estimate_ops(n_bytes):
+    return max(1, -(-n_bytes // THROTTLE_OP_SIZE))
+
+def parse_throttle_spec(spec):
+    # NOTE: spec is a list of whitespace separated `name=value` pairs, with
+    #       the names of the corresponding command line options
+    result = {}
+
+    for token in spec.split():
+        name, sep, value = token.partition('=')
+
+        if not sep:
+            raise ValueError(f"Failed to parse throttle setting: '{token}'")
+
+        if name == THROTTLE_BANDWIDTH:
+            result[name] = parse_size(value)
+        elif name == THROTTLE_IOPS:
+            result[name] = int(value)
+        else:
+            raise ValueError(f"Unknown throttle setting: '{name}'")
+
+    return result
+
+def set_idle_io_priority():
+    # NOTE: ioprio_set has no wrapper in the standard library. The priority
+    #       is inherited by threads and child processes created afterwards.
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine(), None)
+
+    if (syscall is None) or (platform.system() != 'Linux'):
+        LOGGER.warning("Setting I/O priority is not supported on this system")
+        return False
+
+    libc  = ctypes.CDLL(None, use_errno = True)
+    value = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, value) != 0:
+        errno = ctypes.get_errno()
+        LOGGER.warning("Failed to set I/O priority: %s", os.strerror(errno))
+        return False
+
+    return True
+
+class TokenBucket:
+    # NOTE: tokens are reserved at once and may go into debt. A caller that
+    #       takes the bucket into debt waits until the debt is repaid, so
+    #       large requests are allowed, but slow down everyone after them.
+    #       Rate of zero disables the limit.
+
+    def __init__(self, rate = 0, burst = None):
+        self._lock   = threading.Lock()
+        self._rate   = 0
+        self._burst  = 0
+        self._tokens = 0
+        self._stamp  = time.monotonic()
+
+        self.set_rate(rate, burst)
+        self._tokens = self._burst
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate, burst = None):
+        if rate < 0:
+            raise ValueError(f"Rate must not be negative: '{rate}'")
+
+        with self._lock:
+            self._refill()
+
+            # NOTE: by default, allow bursts of up to a second worth of tokens
+            self._rate   = rate
+            self._burst  = burst if (burst is not None) else rate
+            self._tokens = min(self._tokens, self._burst)
+
+    def _refill(self):
+        now = time.monotonic()
+
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._stamp) * self._rate
+        )
+        self._stamp = now
+
+    def reserve(self, n):
+        # NOTE: returns the time [s] to wait before using the reserved tokens
+        with self._lock:
+            if self._rate <= 0:
+                return 0
+
+            self._refill()
+            self._tokens -= n
+
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self._rate
+
+class IOThrottle:
+    # NOTE: limits bandwidth and number of I/O operations of all the readers
+    #       sharing it. Limits can be changed while running by writing them
+    #       to the control file, e.g. `max-bandwidth=50M max-iops=100`.
+
+    def __init__(self, max_bandwidth = 0, max_iops = 0, control_path = None):
+        self._bandwidth    = TokenBucket(max_bandwidth)
+        self._iops         = TokenBucket(max_iops)
+        self._control_path = control_path
+        self._control_lock = threading.Lock()
+        self._control_time = None
+        self._next_check   = 0
+
+        self._check_control()
+
+    @property
+    def max_bandwidth(self):
+        return self._bandwidth.rate
+
+    @property
+    def max_iops(self):
+        return self._iops.rate
+
+    def set_limits(self, max_bandwidth = None, max_iops = None):
+        if max_bandwidth is not None:
+            self._bandwidth.set_rate(max_bandwidth)
+
+        if max_iops is not None:
+            self._iops.set_rate(max_iops)
+
+    def _load_control(self):
+        try:
+            mtime = os.stat(self._control_path).st_mtime_ns
+        except OSError:
+            return
+
+        if mtime == self._control_time:
+            return
+
+        self._control_time = mtime
+
+        try:
+            with open(self._control_path, 'rt', encoding = 'utf-8') as f:
+                limits = parse_throttle_spec(f.read())
+
+            self.set_limits(
+                limits.get(THROTTLE_BANDWIDTH, None),
+                limits.get(THROTTLE_IOPS,      None)
+            )
+        except (OSError, ValueError) as e:
+            LOGGER.warning("Failed to read throttle settings: %s", e)
+            return
+
+        LOGGER.info(
+            "Throttle limits: %d B/s, %d IOPS",
+            self.max_bandwidth, self.max_iops
+        )
+
+    def _check_control(self):
+        if self._control_path is None:
+            return
+
+        with self._control_lock:
+            now = time.monotonic()
+
+            if now < self._next_check:
+                return
+
+            self._next_check = now + THROTTLE_CHECK_INTERVAL
+            self._load_control()
+
+    def acquire(self, n_bytes, n_ops = 1):
+        self._check_control()
+
+        delay = max(
+            self._bandwidth.reserve(n_bytes), self._iops.reserve(n_ops)
+        )
+
+        if delay > 0:
+            time.sleep(delay)
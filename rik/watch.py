@@ -0,0 +1,283 @@
+import collections
+import logging
+import os
+import time
+
+from .consts     import RESULT_ERROR
+from .funcs      import (
+    check_constraints, create_executor, finalize_directory, handle_file,
+    walk_directories, walk_filesystem
+)
+from .inotify    import (
+    Inotify, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE,
+    IN_DELETE, IN_DELETE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR,
+    IN_DONT_FOLLOW, IN_EXCL_UNLINK, IN_ISDIR
+)
+from .path_entry import PathEntry
+from .sinks      import SummarySink
+from .stats      import timed, PHASE_LOAD
+
+LOGGER = logging.getLogger('rik')
+
+# NOTE: files are picked up once they are closed after writing, or moved
+#       into place, never while they are still being written
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+# Time without events after which changes of a directory are processed [s]
+WATCH_DELAY = 5.0
+
+# A directory that keeps changing is processed at least this many delays
+# after its first unprocessed change
+WATCH_MAX_DELAYS = 12
+
+class TreeWatcher:
+    # NOTE: keeps integrities of a directory tree up to date by following
+    #       inotify events. Changes are collected per directory and handled
+    #       in one load/calculate/prune/save cycle once the directory has
+    #       been quiet for `delay` seconds. Reported files are handled with
+    #       `integrity`, which should recalculate them. After lost events the
+    #       tree is walked with `rescan_integrity`, which should not, so that
+    #       silently corrupted files are not stored as their new state.
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self, root_dir, integrity, rescan_integrity, dir_constraints,
+        file_constraints, jobs = 1, sink = None, stats = None,
+        delay = WATCH_DELAY
+    ):
+        # pylint: disable=too-many-arguments
+        self._root_dir         = root_dir
+        self._integrity        = integrity
+        self._rescan_integrity = rescan_integrity
+        self._dir_constraints  = dir_constraints
+        self._file_constraints = file_constraints
+        self._jobs             = jobs
+        self._sink             = sink if (sink is not None) else SummarySink()
+        self._stats            = stats
+        self._delay            = delay
+        self._inotify          = None
+        self._overflow         = False
+
+        self._paths   = {}
+        self._wds     = {}
+        self._changed = collections.defaultdict(set)
+        self._deleted = collections.defaultdict(set)
+        self._times   = {}
+
+    @property
+    def sink(self):
+        return self._sink
+
+    @property
+    def n_watched(self):
+        return len(self._wds)
+
+    def _watch_tree(self, path, queue_files):
+        for root_entry, files in walk_directories(
+            path, self._dir_constraints, self._sink
+        ):
+            root = root_entry.path
+
+            try:
+                wd = self._inotify.add_watch(root, WATCH_MASK)
+            except OSError as e:
+                LOGGER.error(e)
+                self._sink.add(root, RESULT_ERROR)
+                continue
+
+            self._paths[wd] = root
+            self._wds[root] = wd
+
+            # NOTE: files may have appeared before the watch was added
+            if queue_files:
+                for entry in files:
+                    self._queue(root, entry.name, True)
+
+    def _unwatch_tree(self, path):
+        prefix = os.path.join(path, '')
+        roots  = [
+            x for x in self._wds if (x == path) or x.startswith(prefix)
+        ]
+
+        for root in roots:
+            wd = self._wds.pop(root)
+            self._paths.pop(wd, None)
+            self._inotify.rm_watch(wd)
+
+    def _queue(self, root, name, changed):
+        # NOTE: skips excluded files, e.g. the integrity storages written
+        #       by the watcher itself
+        if not check_constraints(
+            PathEntry(os.path.join(root, name)), self._dir_constraints
+        ):
+            return
+
+        if changed:
+            self._changed[root].add(name)
+            self._deleted[root].discard(name)
+        else:
+            self._deleted[root].add(name)
+            self._changed[root].discard(name)
+
+        now = time.monotonic()
+        self._times[root] = (self._times.get(root, (now, now))[0], now)
+
+    def _handle_event(self, event):
+        # pylint: disable=too-many-return-statements
+        if event.mask & IN_Q_OVERFLOW:
+            self._overflow = True
+            return
+
+        root = self._paths.get(event.wd, None)
+
+        if root is None:
+            return
+
+        if event.mask & IN_IGNORED:
+            self._paths.pop(event.wd)
+
+            if self._wds.get(root, None) == event.wd:
+                self._wds.pop(root)
+
+            return
+
+        if event.mask & IN_DELETE_SELF:
+            return
+
+        path = os.path.join(root, event.name)
+
+        if event.mask & IN_ISDIR:
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path, True)
+            elif event.mask & IN_MOVED_FROM:
+                self._unwatch_tree(path)
+
+            return
+
+        if event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._queue(root, event.name, True)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+            self._queue(root, event.name, False)
+
+    def _process_directory(self, root, executor):
+        changed = self._changed.pop(root, set())
+        deleted = self._deleted.pop(root, set())
+        self._times.pop(root, None)
+
+        # NOTE: storages of a removed directory are gone with it
+        if not os.path.isdir(root):
+            return
+
+        deleted = {
+            x for x in deleted if not os.path.lexists(os.path.join(root, x))
+        }
+
+        LOGGER.info(
+            "Processing directory '%s': %d changed, %d deleted",
+            root, len(changed), len(deleted)
+        )
+
+        integrity = self._integrity
+
+        try:
+            with timed(self._stats, PHASE_LOAD):
+                integrity.load(root)
+        except IOError:
+            self._sink.add(root, RESULT_ERROR)
+            return
+
+        # NOTE: only the deleted files are pruned, without listing the
+        #       directory
+        for file_name in integrity.known_files:
+            if file_name not in deleted:
+                integrity.mark_as_seen(file_name)
+
+        futures = [
+            executor.submit(
+                handle_file,
+                PathEntry(os.path.join(root, x)), integrity,
+                self._file_constraints, self._sink, True, False, self._stats
+            )
+            for x in sorted(changed)
+        ]
+
+        finalize_directory(
+            root, integrity, futures, True, True, self._sink, self._stats
+        )
+
+    def _rescan(self):
+        # NOTE: events were lost, so the whole tree is processed again. Only
+        #       unknown files get integrities and removed ones are pruned.
+        LOGGER.warning(
+            "Too many events. Processing '%s' again.", self._root_dir
+        )
+
+        self._overflow = False
+        self._changed.clear()
+        self._deleted.clear()
+        self._times.clear()
+
+        self._watch_tree(self._root_dir, False)
+
+        walk_filesystem(
+            self._root_dir, self._rescan_integrity, self._dir_constraints,
+            self._file_constraints, True, True, False, self._jobs,
+            self._sink, stats = self._stats
+        )
+
+    def _get_timeout(self):
+        if not self._times:
+            return None
+
+        now = time.monotonic()
+
+        return max(0, min(
+            min(last + self._delay, first + WATCH_MAX_DELAYS * self._delay)
+                for (first, last) in self._times.values()
+        ) - now)
+
+    def _process_ready(self, executor, force = False):
+        now   = time.monotonic()
+        ready = [
+            root for (root, (first, last)) in self._times.items()
+                if force or (now - last >= self._delay)
+                or (now - first >= WATCH_MAX_DELAYS * self._delay)
+        ]
+
+        for root in sorted(ready):
+            self._process_directory(root, executor)
+
+    def run(self):
+        # NOTE: runs until interrupted or the tree root is removed. Changes
+        #       collected so far are processed before returning.
+        with Inotify() as inotify:
+            self._inotify = inotify
+            self._watch_tree(self._root_dir, False)
+
+            LOGGER.info(
+                "Watching %d directories under '%s'",
+                len(self._wds), self._root_dir
+            )
+
+            with create_executor(self._jobs) as executor:
+                try:
+                    while self._wds:
+                        for event in inotify.read(self._get_timeout()):
+                            self._handle_event(event)
+
+                        if self._overflow:
+                            self._rescan()
+                            continue
+
+                        self._process_ready(executor)
+                except KeyboardInterrupt:
+                    LOGGER.info("Stopping watching '%s'", self._root_dir)
+
+                self._process_ready(executor, force = True)
+
+            self._inotify = None
+
+        return self._sink